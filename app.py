@@ -1,7 +1,10 @@
-from flask import Flask, jsonify, request, Response
+from flask import Flask, jsonify, request, Response, send_file, g
 import qbittorrentapi
 from transmission_rpc import Client as TransmissionClient
 import requests
+import websocket
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
 import logging
 import json
@@ -9,7 +12,20 @@ import threading
 import time
 import copy
 import hashlib
+import io
 import secrets
+from urllib.parse import urlparse
+import tempfile
+import gzip
+import atexit
+import re
+from array import array
+import mimetypes
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeout
+try: import fcntl
+except ImportError: fcntl = None  # Windows 上只会单进程运行，不需要跨进程锁
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -22,13 +38,20 @@ def get_env(key, default=None, is_int=False):
     if is_int and val: return int(val)
     return val
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # 原有配置
-QB_HOST = get_env("QB_HOST"); QB_PORT = get_env("QB_PORT", 8080, True); QB_USER = get_env("QB_USER"); QB_PASS = get_env("QB_PASS")
-TR_HOST = get_env("TR_HOST"); TR_PORT = get_env("TR_PORT", 9091, True); TR_USER = get_env("TR_USER"); TR_PASS = get_env("TR_PASS")
+# qB / TR 实例由 load_instances 统一读取：QB_HOST/QB_PORT/QB_USER/QB_PASS (TR_ 同理)，
+# 多实例再加 QB_HOST_1.. / TR_HOST_1.. 索引变量，或 CLIENTS_FILE 指向的 JSON 文件 {"qb": [...], "tr": [...]}
+CLIENTS_FILE = get_env("CLIENTS_FILE")
 EMBY_HOST = get_env("EMBY_HOST"); EMBY_KEY  = get_env("EMBY_KEY")
 ABS_HOST  = get_env("ABS_HOST"); ABS_KEY   = get_env("ABS_KEY")
-MP_HOST = get_env("MP_HOST"); MP_USER = get_env("MP_USER"); MP_PASS = get_env("MP_PASS")
+ABS_STATS_TTL = get_env("ABS_STATS_TTL", 300, True); ABS_FANOUT = get_env("ABS_FANOUT", 4, True)
+MP_HOST = get_env("MP_HOST"); MP_USER = get_env("MP_USER"); MP_PASS = get_env("MP_PASS"); MP_CACHE_TTL = get_env("MP_CACHE_TTL", 300, True)
 NAVI_HOST = get_env("NAVI_HOST"); NAVI_USER = get_env("NAVI_USER"); NAVI_PASS = get_env("NAVI_PASS")
+COVER_CACHE_DIR = get_env("COVER_CACHE_DIR", os.path.join(BASE_DIR, "cache", "covers"))
+COVER_CACHE_MB = get_env("COVER_CACHE_MB", 200, True); COVER_SIZE = get_env("COVER_SIZE", 300, True)
+NAVI_QUEUE_BATCH = get_env("NAVI_QUEUE_BATCH", 20, True); NAVI_QUEUE_LOW = get_env("NAVI_QUEUE_LOW", 5, True)
 
 # HA 配置
 HASS_HOST  = get_env("HASS_HOST")
@@ -39,6 +62,29 @@ HASS_ID_MONTH_DL = get_env("HASS_ID_MONTH_DL")
 HASS_ID_MONTH_UL = get_env("HASS_ID_MONTH_UL")
 HASS_UNIT_FIX = get_env("HASS_UNIT_FIX")
 
+# HTTP 连接池：默认超时 / 重试次数 / 每个上游的连接数 / 证书校验(不设则按上游默认)
+# 所有上游 (含 qB / TR 客户端) 默认都用 HTTP_TIMEOUT，可按上游单独覆盖：<名称>_TIMEOUT，
+# 如 NAVI_TIMEOUT、MOVIEPILOT_TIMEOUT、QB_TIMEOUT、TR_TIMEOUT；STREAM_TIMEOUT 为音频流的读超时
+HTTP_TIMEOUT = get_env("HTTP_TIMEOUT", 5, True)
+STREAM_TIMEOUT = get_env("STREAM_TIMEOUT", 30, True)
+HTTP_RETRIES = get_env("HTTP_RETRIES", 1, True)
+HTTP_POOL_SIZE = get_env("HTTP_POOL_SIZE", 8, True)
+HTTP_VERIFY = get_env("HTTP_VERIFY")
+
+# 运行角色：all = 单进程(默认)；collector = 只采集并发布快照；web = 只从共享快照提供接口(可多 worker)
+ROLE = get_env("ROLE", "all").lower()
+SHARED_DIR = get_env("SHARED_DIR", os.path.join(tempfile.gettempdir(), "pt-monitor"))
+
+# 熔断：连续失败多少次后打开；打开后的退避上限(秒)
+BREAKER_THRESHOLD = get_env("BREAKER_THRESHOLD", 3, True)
+BREAKER_MAX = get_env("BREAKER_MAX", 300, True)
+
+# 历史曲线快照文件及保存间隔(秒)
+HISTORY_FILE = get_env("HISTORY_FILE", os.path.join(BASE_DIR, "cache", "history.bin"))
+HISTORY_SAVE = get_env("HISTORY_SAVE", 300, True)
+# collector 角色另把历史发布到 SHARED_DIR 供 web worker 读取的间隔(秒)
+HISTORY_PUBLISH = get_env("HISTORY_PUBLISH", 5, True)
+
 # ================= 2. 工具类 =================
 def get_subsonic_auth():
     if not NAVI_PASS: return {}
@@ -58,6 +104,127 @@ def smart_format(state, unit):
     final_unit = f"{power_labels[n_step]}B" if n_step > 0 else unit_suffix
     return f"{n:.2f} {final_unit}"
 
+@contextmanager
+def file_lock(path):
+    # 跨进程互斥 (flock)：多个 web worker 共用同一份磁盘状态时串行化读改写
+    with open(path, 'a') as f:
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+class Metrics:
+    # 极简 Prometheus 指标：counter / gauge / histogram，按 (指标名, 标签) 存储，/metrics 输出文本格式
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    def __init__(self):
+        self.lock = threading.Lock(); self.meta = {}
+        self.values = {}  # (name, labels) -> float
+        self.hists = {}   # (name, labels) -> [各桶计数, 总和, 个数]
+    def _key(self, name, kind, doc, labels):
+        self.meta.setdefault(name, (kind, doc))
+        return name, tuple(sorted(labels.items()))
+    def inc(self, name, doc, labels, v=1):
+        with self.lock:
+            k = self._key(name, "counter", doc, labels); self.values[k] = self.values.get(k, 0) + v
+    def set(self, name, doc, labels, v):
+        with self.lock: self.values[self._key(name, "gauge", doc, labels)] = v
+    def observe(self, name, doc, labels, v):
+        with self.lock:
+            h = self.hists.setdefault(self._key(name, "histogram", doc, labels), [[0] * len(self.BUCKETS), 0.0, 0])
+            for i, b in enumerate(self.BUCKETS):
+                if v <= b: h[0][i] += 1
+            h[1] += v; h[2] += 1
+    def get(self, name, labels):
+        return self.values.get((name, tuple(sorted(labels.items()))))
+    def dump(self):
+        with self.lock:
+            return {"meta": self.meta, "values": [[n, l, v] for (n, l), v in self.values.items()],
+                    "hists": [[n, l, h] for (n, l), h in self.hists.items()]}
+    def merge(self, d):
+        # 合并另一个进程 dump 出的指标：counter / histogram 累加，gauge 取后来者
+        with self.lock:
+            for name, (kind, doc) in d["meta"].items(): self.meta.setdefault(name, (kind, doc))
+            for n, l, v in d["values"]:
+                k = (n, tuple(map(tuple, l)))
+                self.values[k] = self.values.get(k, 0) + v if self.meta[n][0] == "counter" else v
+            for n, l, (counts, total, count) in d["hists"]:
+                h = self.hists.setdefault((n, tuple(map(tuple, l))), [[0] * len(self.BUCKETS), 0.0, 0])
+                h[0] = [a + b for a, b in zip(h[0], counts)]; h[1] += total; h[2] += count
+    def render(self):
+        def esc(v): return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in items) + "}" if items else ""
+        out = []
+        with self.lock:
+            for name, (kind, doc) in sorted(self.meta.items()):
+                out.append(f"# HELP {name} {doc}"); out.append(f"# TYPE {name} {kind}")
+                if kind == "histogram":
+                    for (n, labels), (counts, total, count) in sorted(self.hists.items()):
+                        if n != name: continue
+                        for b, c in zip(self.BUCKETS, counts): out.append(f"{name}_bucket{fmt(labels, [('le', b)])} {c}")
+                        out.append(f"{name}_bucket{fmt(labels, [('le', '+Inf')])} {count}")
+                        out.append(f"{name}_sum{fmt(labels)} {total}"); out.append(f"{name}_count{fmt(labels)} {count}")
+                else:
+                    for (n, labels), v in sorted(self.values.items()):
+                        if n == name: out.append(f"{name}{fmt(labels)} {v}")
+        return "\n".join(out) + "\n"
+
+METRICS = Metrics()
+
+def upstream_timeout(name):
+    return get_env(f"{name.upper()}_TIMEOUT", HTTP_TIMEOUT, True)
+
+class Upstream:
+    # 每个上游一个长连接池 (keep-alive)，超时、重试、证书校验统一在这里配置，调用处不再各写各的超时
+    def __init__(self, name, verify=True):
+        self.name = name; self.timeout = upstream_timeout(name)
+        self.session = requests.Session()
+        retry = Retry(total=HTTP_RETRIES, read=0, backoff_factor=0.2, status_forcelist=(502, 503, 504), allowed_methods=frozenset(["GET", "HEAD"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+        self.session.mount("http://", adapter); self.session.mount("https://", adapter)
+        v = get_env(f"{name.upper()}_VERIFY", HTTP_VERIFY)
+        self.session.verify = verify if v is None else v.lower() not in ("0", "false", "no")
+    def request(self, method, url, timeout=None, **kw):
+        return self.session.request(method, url, timeout=timeout or self.timeout, **kw)
+    def get(self, url, **kw): return self.request("GET", url, **kw)
+    def get_json(self, url, **kw):
+        # 上游报错 (4xx/5xx) 时抛异常交给熔断器处理，而不是把错误页当成 0 条数据
+        res = self.get(url, **kw); res.raise_for_status()
+        return res.json()
+    def post(self, url, **kw): return self.request("POST", url, **kw)
+
+UPSTREAMS = {}
+def upstream(name, verify=True):
+    if name not in UPSTREAMS: UPSTREAMS[name] = Upstream(name, verify)
+    return UPSTREAMS[name]
+
+class TorrentIndex:
+    # 本地种子状态表：只保留卡片需要的字段，随增删改增量维护计数，不再每轮全量扫描
+    # group 给出分组键 (如 tracker 域名) 时，同时按组维护 total/act/done/error
+    def __init__(self, classify, group=None):
+        self.classify = classify; self.group = group; self.rows = {}
+        self.counts = {"act": 0, "done": 0, "error": 0}; self.groups = {}
+    def _apply(self, row, sign):
+        hits = self.classify(row)
+        for k, hit in hits.items():
+            if hit: self.counts[k] += sign
+        g = self.group(row) if self.group else None
+        if g:
+            c = self.groups.setdefault(g, {"total": 0, "act": 0, "done": 0, "error": 0}); c["total"] += sign
+            for k, hit in hits.items():
+                if hit: c[k] += sign
+            if c["total"] <= 0: del self.groups[g]
+    def upsert(self, key, fields):
+        old = self.rows.get(key)
+        if old is not None: self._apply(old, -1); row = {**old, **fields}
+        else: row = dict(fields)
+        self.rows[key] = row; self._apply(row, 1)
+    def remove(self, key):
+        old = self.rows.pop(key, None)
+        if old is not None: self._apply(old, -1)
+    def clear(self):
+        self.rows = {}; self.counts = dict.fromkeys(self.counts, 0); self.groups = {}
+    def __len__(self): return len(self.rows)
+
 class TokenClient:
     def __init__(self, name, host, user, pwd, login_paths):
         self.name = name
@@ -65,81 +232,364 @@ class TokenClient:
         else: self.host = host.rstrip('/') if host else ""
         self.user = user; self.pwd = pwd
         self.login_paths = login_paths if isinstance(login_paths, list) else [login_paths]
-        self.token = None
+        self.token = None; self.http = upstream(name.lower(), verify=False)
+        self.login_fails = 0; self.login_retry_at = 0; self.cache = {}
         self.headers = {"User-Agent": "HomeLab/1.0", "Accept": "application/json"}
     def login(self):
         if not self.host or not self.user or not self.pwd: return False
+        # 登录失败后指数退避，上游挂掉时不再每轮把所有登录方式都试一遍
+        if time.time() < self.login_retry_at: return False
         for path in self.login_paths:
             try:
                 url = f"{self.host}{path}"
-                try: res = requests.post(url, json={"username": self.user, "password": self.pwd}, headers=self.headers, timeout=5, verify=False)
+                try: res = self.http.post(url, json={"username": self.user, "password": self.pwd}, headers=self.headers)
                 except: res = None
                 if not res or res.status_code >= 400:
-                    res = requests.post(url, data={"username": self.user, "password": self.pwd}, headers=self.headers, timeout=5, verify=False)
+                    res = self.http.post(url, data={"username": self.user, "password": self.pwd}, headers=self.headers)
                 if res and res.status_code == 200:
                     data = res.json()
-                    if "access_token" in data: self.token = data["access_token"]; self.headers["Authorization"] = f"Bearer {self.token}"; return True
+                    if "access_token" in data:
+                        self.token = data["access_token"]; self.headers["Authorization"] = f"Bearer {self.token}"
+                        self.login_fails = 0; self.login_retry_at = 0; return True
             except: pass
+        self.login_fails += 1; self.login_retry_at = time.time() + min(5 * 2 ** (self.login_fails - 1), 300)
         return False
-    def get(self, endpoint):
+    def get(self, endpoint, max_age=0):
+        # max_age 内直接用缓存；过期后带 ETag / Last-Modified 做条件请求，304 时沿用缓存
+        cached = self.cache.get(endpoint)
+        if cached and time.time() - cached["at"] < max_age: return cached["data"]
         if not self.token and not self.login(): return None
         try:
-            url = f"{self.host}{endpoint}"; res = requests.get(url, headers=self.headers, timeout=8, verify=False)
+            url = f"{self.host}{endpoint}"; h = dict(self.headers)
+            if cached and cached.get("etag"): h["If-None-Match"] = cached["etag"]
+            if cached and cached.get("modified"): h["If-Modified-Since"] = cached["modified"]
+            res = self.http.get(url, headers=h)
             if res.status_code == 401: 
-                if self.login(): res = requests.get(url, headers=self.headers, timeout=8, verify=False)
-            if res.status_code == 200: return res.json()
+                if self.login(): h["Authorization"] = self.headers["Authorization"]; res = self.http.get(url, headers=h)
+            if res.status_code == 304 and cached:
+                cached["at"] = time.time(); return cached["data"]
+            if res.status_code == 200:
+                data = res.json()
+                if max_age: self.cache[endpoint] = {"data": data, "at": time.time(), "etag": res.headers.get("ETag"), "modified": res.headers.get("Last-Modified")}
+                return data
         except: pass
         return None
 
+EMBY_HTTP = upstream("emby"); ABS_HTTP = upstream("abs"); NAVI_HTTP = upstream("navi", verify=False); HASS_HTTP = upstream("hass")
 mp_client = TokenClient("MoviePilot", MP_HOST, MP_USER, MP_PASS, ["/api/v1/login/access-token"])
 
+class CoverCache:
+    # 封面磁盘 LRU：按 (封面id, 尺寸) 缓存，文件名 = key-内容哈希.扩展名，内容哈希直接作强 ETag
+    # 同一封面的并发未命中请求共用一次上游下载
+    # 多个 web worker 共用同一目录：每次写入后在文件锁里扫描目录、按 mtime (命中时 touch) 淘汰最久未用的，
+    # 总量以磁盘为准；内存索引只是本进程的查找提示，扫描时重建，指向的文件不在了就当未命中
+    EXT = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+    def __init__(self, root, max_bytes):
+        self.root = root; self.max_bytes = max_bytes
+        self.lock = threading.Lock(); self.inflight = {}
+        self.index = {}; self.broken = False  # key -> 文件名；broken = 目录不可写，封面直接从内存返回
+        try: os.makedirs(root, exist_ok=True); self._evict()
+        except OSError as e: logger.warning(f"封面缓存目录不可用: {e}")
+    def _entry(self, name):
+        ext = name.rsplit('.', 1)[-1]
+        return os.path.join(self.root, name), mimetypes.guess_type(f"x.{ext}")[0] or "image/jpeg", name.split('-')[1].split('.')[0]
+    def _evict(self):
+        with file_lock(os.path.join(self.root, ".lock")):
+            files = []
+            with os.scandir(self.root) as it:
+                for e in it:
+                    if e.name.startswith('.') or '-' not in e.name: continue
+                    try: st = e.stat()
+                    except FileNotFoundError: continue
+                    files.append((st.st_mtime, e.name, st.st_size))
+            files.sort(); total = sum(f[2] for f in files); keep = 0
+            for _, name, size in files[:-1]:
+                if total <= self.max_bytes: break
+                try: os.remove(os.path.join(self.root, name))
+                except FileNotFoundError: pass
+                total -= size; keep += 1
+        index = {name.split('-')[0]: name for _, name, _ in files[keep:]}
+        with self.lock: self.index = index
+    def get(self, cover_id, size=0):
+        key = hashlib.sha1(f"{cover_id}:{size}".encode('utf-8')).hexdigest()
+        with self.lock:
+            hit = self.index.get(key)
+            if hit:
+                # 文件被外部删掉 (手动清理、其他进程淘汰) 时当作未命中，移出索引重新下载
+                try: os.utime(os.path.join(self.root, hit)); return self._entry(hit)
+                except FileNotFoundError: self.index.pop(key)
+            fut = self.inflight.get(key); owner = fut is None
+            if owner: fut = self.inflight[key] = Future()
+        if not owner: return fut.result(timeout=15)
+        try:
+            entry = self._fetch(key, cover_id, size); fut.set_result(entry); return entry
+        except Exception as e: fut.set_exception(e); raise
+        finally:
+            with self.lock: self.inflight.pop(key, None)
+    def _fetch(self, key, cover_id, size):
+        p = get_subsonic_auth(); p['id'] = cover_id
+        if size: p['size'] = size
+        res = NAVI_HTTP.get(f"{NAVI_HOST.rstrip('/')}/rest/getCoverArt", params=p)
+        ctype = res.headers.get('Content-Type', '').split(';')[0].strip()
+        if res.status_code != 200 or not ctype.startswith('image/'): raise ValueError(f"cover {cover_id}: {res.status_code} {ctype}")
+        data = res.content
+        name = f"{key}-{hashlib.sha1(data).hexdigest()[:16]}.{self.EXT.get(ctype, 'jpg')}"
+        tmp = os.path.join(self.root, f".{name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'wb') as f: f.write(data)
+            os.replace(tmp, os.path.join(self.root, name))
+        except OSError as e:
+            # 缓存目录不可用时不缓存，直接返回内容 (bytes)，封面照常显示
+            if not self.broken: logger.warning(f"封面缓存写入失败，改为直接代理: {e}")
+            self.broken = True; return data, ctype, self._entry(name)[2]
+        self.broken = False
+        with self.lock: old = self.index.get(key); self.index[key] = name
+        if old and old != name:
+            # 同一封面内容变了：旧文件不会再被引用，直接删掉
+            try: os.remove(os.path.join(self.root, old))
+            except FileNotFoundError: pass
+        self._evict()
+        return self._entry(name)
+
+cover_cache = CoverCache(COVER_CACHE_DIR, COVER_CACHE_MB * 1048576)
+
+class RandomQueue:
+    # 随机歌曲预取队列：后台按批 (size=N) 拉取，低于水位线时补货，切歌直接从内存出队
+    def __init__(self, batch, low):
+        self.batch = batch; self.low = low
+        self.items = deque(); self.lock = threading.Lock(); self.wake = threading.Event()
+        self.thread = None
+    def fetch(self):
+        p = get_subsonic_auth(); p['size'] = self.batch
+        res = NAVI_HTTP.get(f"{NAVI_HOST.rstrip('/')}/rest/getRandomSongs", params=p)
+        return res.json()['subsonic-response']['randomSongs'].get('song', [])
+    def refill(self):
+        while True:
+            self.wake.wait(); self.wake.clear()
+            if len(self.items) > self.low: continue
+            # 失败不自己重试：下一次出队 (有人在听) 时再唤醒，Navidrome 挂掉时不会空转请求
+            try: songs = self.fetch()
+            except Exception as e: logger.warning(f"随机队列补货失败: {e}"); continue
+            with self.lock:
+                queued = {x['id'] for x in self.items}
+                self.items.extend(x for x in songs if x['id'] not in queued)
+    def pop(self):
+        # 返回 (当前歌曲, 下一首)；队列为空时同步拉一批
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.refill, daemon=True, name="navi-queue"); self.thread.start()
+            song = self.items.popleft() if self.items else None
+        if song is None:
+            songs = self.fetch()
+            with self.lock: self.items.extend(songs[1:])
+            song = songs[0]
+        with self.lock: nxt = self.items[0] if self.items else None
+        if len(self.items) <= self.low: self.wake.set()
+        return song, nxt
+
+class SharedRandomQueue(RandomQueue):
+    # web 角色：队列放在 SHARED_DIR 的 JSON 文件里，各 worker 在文件锁里出队同一个队列，
+    # 返回给前端的 next 就是下一次 /api/navi/random 真正会给出的歌曲，不管请求落到哪个 worker
+    def __init__(self, path, batch, low):
+        super().__init__(batch, low); self.path = path; self.refilling = False
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f: return json.load(f)
+        except (OSError, ValueError): return []
+    def _save(self, items):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f: json.dump(items, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+    def refill(self):
+        try:
+            songs = self.fetch()
+            with file_lock(f"{self.path}.lock"):
+                items = self._load()
+                if len(items) <= self.low:
+                    queued = {x['id'] for x in items}
+                    self._save(items + [x for x in songs if x['id'] not in queued])
+        except Exception as e: logger.warning(f"随机队列补货失败: {e}")
+        finally: self.refilling = False
+    def pop(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with file_lock(f"{self.path}.lock"):
+            items = self._load() or self.fetch()
+            song = items.pop(0); nxt = items[0] if items else None
+            self._save(items)
+        if len(items) <= self.low and not self.refilling:
+            self.refilling = True; threading.Thread(target=self.refill, daemon=True, name="navi-queue").start()
+        return song, nxt
+
+navi_queue = (SharedRandomQueue(os.path.join(SHARED_DIR, "navi-queue.json"), NAVI_QUEUE_BATCH, NAVI_QUEUE_LOW) if ROLE == "web"
+              else RandomQueue(NAVI_QUEUE_BATCH, NAVI_QUEUE_LOW))
+
 # ================= 3. 数据获取 =================
+def qb_classify(t):
+    st = t.get('state', '')
+    return {"act": st not in ['pausedDL','pausedUP','completed','error','unknown'], "done": t.get('progress') == 1, "error": st in ['error','missingFiles']}
+
+def tracker_host(url):
+    try: return urlparse(url).hostname or ""
+    except ValueError: return ""
+
+class QBSync:
+    # 长连接 + sync/maindata 的 rid 增量，每轮只传输变化过的种子
+    FIELDS = ("state", "progress", "tracker")
+    def __init__(self, name, host, port, user, pwd):
+        self.name = name; self.host = host; self.port = port; self.user = user; self.pwd = pwd
+        self.client = None; self.rid = 0; self.server = {}
+        self.index = TorrentIndex(qb_classify, lambda t: tracker_host(t.get('tracker', '')))
+    def poll(self):
+        try:
+            if self.client is None:
+                self.client = qbittorrentapi.Client(host=self.host, port=self.port, username=self.user, password=self.pwd, REQUESTS_ARGS={"timeout": upstream_timeout("qb")})
+                self.client.auth_log_in()
+            d = self.client.sync_maindata(rid=self.rid)
+        except Exception:
+            # 连接或会话出错：丢弃客户端，下一轮重新登录并全量同步
+            self.client = None; self.rid = 0; raise
+        if d.get('full_update'): self.index.clear(); self.server = {}
+        for h in d.get('torrents_removed') or []: self.index.remove(h)
+        for h, t in (d.get('torrents') or {}).items(): self.index.upsert(h, {k: t[k] for k in self.FIELDS if k in t})
+        self.server.update(d.get('server_state') or {})
+        self.rid = d.get('rid', self.rid)
+        return self
+    def speeds(self): return self.server.get('dl_info_speed', 0), self.server.get('up_info_speed', 0)
+
+def tr_classify(t):
+    return {"act": t.get('status') != 'stopped' and t.get('error') == 0, "done": t.get('percent_done') == 1, "error": t.get('error', 0) != 0}
+
+class TRSync:
+    # 长连接 + 只取必要字段；首次全量，之后只拉 recently-active（含已删除 id）
+    FIELDS = ["id", "status", "error", "percentDone", "trackers"]
+    RESYNC = 300  # recently-active 只覆盖最近一分钟，定期全量校正一次
+    def __init__(self, name, host, port, user, pwd):
+        self.name = name; self.host = host; self.port = port; self.user = user; self.pwd = pwd
+        self.client = None; self.synced_at = 0; self.stats = None
+        self.index = TorrentIndex(tr_classify, lambda t: t.get('tracker'))
+    def _row(self, t):
+        trackers = t.fields.get('trackers') or []
+        return {"status": t.status, "error": t.error, "percent_done": t.percent_done, "tracker": tracker_host(trackers[0].get('announce', '')) if trackers else ""}
+    def poll(self):
+        try:
+            if self.client is None:
+                self.client = TransmissionClient(host=self.host, port=self.port, username=self.user, password=self.pwd, timeout=upstream_timeout("tr"))
+            self.stats = self.client.session_stats()
+            if time.time() - self.synced_at > self.RESYNC:
+                tor = self.client.get_torrents(arguments=self.FIELDS)
+                self.index.clear()
+                for t in tor: self.index.upsert(t.id, self._row(t))
+                self.synced_at = time.time()
+            else:
+                active, removed = self.client.get_recently_active_torrents(arguments=self.FIELDS)
+                for tid in removed: self.index.remove(tid)
+                for t in active: self.index.upsert(t.id, self._row(t))
+        except Exception:
+            self.client = None; self.synced_at = 0; raise
+        return self
+    def speeds(self): return self.stats.download_speed, self.stats.upload_speed
+
+def load_instances(prefix, default_port):
+    # 依次收集 <P>_HOST、<P>_HOST_1..N、CLIENTS_FILE 里的实例
+    out = []
+    def add(name, host, port, user, pwd):
+        if host: out.append({"name": name, "host": host, "port": int(port or default_port), "user": user, "pwd": pwd})
+    add(get_env(f"{prefix}_NAME", prefix.lower()), get_env(f"{prefix}_HOST"), get_env(f"{prefix}_PORT"), get_env(f"{prefix}_USER"), get_env(f"{prefix}_PASS"))
+    for i in range(1, 100):
+        add(get_env(f"{prefix}_NAME_{i}", f"{prefix.lower()}{i}"), get_env(f"{prefix}_HOST_{i}"), get_env(f"{prefix}_PORT_{i}"), get_env(f"{prefix}_USER_{i}"), get_env(f"{prefix}_PASS_{i}"))
+    if CLIENTS_FILE:
+        try:
+            with open(CLIENTS_FILE, encoding='utf-8') as f: conf = json.load(f)
+            for i, x in enumerate(conf.get(prefix.lower(), [])):
+                add(x.get("name", f"{prefix.lower()}-{i}"), x.get("host"), x.get("port"), x.get("user"), x.get("pass", x.get("password")))
+        except (OSError, ValueError) as e: logger.warning(f"读取 {CLIENTS_FILE} 失败: {e}")
+    return out
+
+class Fleet:
+    # 同类下载器的多个实例：各自持久会话、并发轮询，汇总速度和计数；tracker 分布由各实例增量维护后相加
+    # 单个实例失败时沿用它上次成功的计数和速度 (轮询出错不会改动实例的本地索引)，并带上该实例的 stale_since
+    def __init__(self, kind, members):
+        self.kind = kind; self.members = members
+        self.pool = ThreadPoolExecutor(max_workers=max(1, min(len(members), 32)), thread_name_prefix=kind) if members else None
+        self.seen = set(); self.stale = {}  # 成功过的实例 / 实例 -> 开始失败的时间
+    def _poll(self, m):
+        t0 = time.time()
+        try: return m.poll()
+        finally: METRICS.observe("ptmon_instance_duration_seconds", "Per-instance download client poll latency", {"source": self.kind, "instance": m.name}, time.time() - t0)
+    def poll(self):
+        futs = [(m, self.pool.submit(self._poll, m)) for m in self.members]
+        dl = ul = total = 0; counts = {"act": 0, "done": 0, "error": 0}; trackers = {}; instances = []; err = None
+        for m, f in futs:
+            try:
+                f.result(); self.seen.add(m); self.stale.pop(m, None); inst = {"name": m.name, "status": True}
+            except Exception as e:
+                err = e
+                if m not in self.seen: instances.append({"name": m.name, "status": False}); continue
+                inst = {"name": m.name, "status": False, "stale_since": self.stale.setdefault(m, int(time.time()))}
+            d, u = m.speeds(); c = m.index.counts
+            dl += d; ul += u; total += len(m.index)
+            for k in counts: counts[k] += c[k]
+            for host, g in m.index.groups.items():
+                t = trackers.setdefault(host, {"total": 0, "act": 0, "done": 0, "error": 0})
+                for k in t: t[k] += g[k]
+            instances.append({**inst, "dl_speed": d, "ul_speed": u, "val1": c["act"], "val2": c["done"], "val3": len(m.index), "error": c["error"]})
+        # 全部实例都失败时抛出，交给熔断器
+        if err is not None and all(not x["status"] for x in instances): raise err
+        res = {"status": True, "dl": f"{round(dl/1048576,1)} MB/s", "ul": f"{round(ul/1048576,1)} MB/s", "dl_speed": dl, "ul_speed": ul,
+               "val1": counts["act"], "val2": counts["done"], "val3": total, "error": counts["error"],
+               "online": sum(1 for x in instances if x["status"]), "instances": instances, "trackers": trackers}
+        # 有实例在用旧数据时整张卡片标为过期，时间取最早的那个
+        stale = [x["stale_since"] for x in instances if "stale_since" in x]
+        if stale: res["stale_since"] = min(stale)
+        return res
+
+qb_fleet = Fleet("qb", [QBSync(**x) for x in load_instances("QB", 8080)])
+tr_fleet = Fleet("tr", [TRSync(**x) for x in load_instances("TR", 9091)])
+
 def get_qb_data():
-    try:
-        if not QB_HOST: return {"status": False, "msg": "未配置"}
-        qb = qbittorrentapi.Client(host=QB_HOST, port=QB_PORT, username=QB_USER, password=QB_PASS)
-        qb.auth_log_in()
-        t = qb.transfer_info(); tor = qb.torrents_info()
-        act = sum(1 for x in tor if x.state not in ['pausedDL','pausedUP','completed','error','unknown'])
-        return {"status": True, "dl": f"{round(t.dl_info_speed/1048576,1)} MB/s", "ul": f"{round(t.up_info_speed/1048576,1)} MB/s", "val1": act, "val2": sum(1 for x in tor if x.progress==1), "val3": len(tor), "error": sum(1 for x in tor if x.state in ['error','missingFiles'])}
-    except: return {"status": False, "msg": "连接失败"}
+    if not qb_fleet.members: return {"status": False, "msg": "未配置"}
+    return qb_fleet.poll()
 
 def get_tr_data():
-    try:
-        if not TR_HOST: return {"status": False, "msg": "未配置"}
-        tr = TransmissionClient(host=TR_HOST, port=TR_PORT, username=TR_USER, password=TR_PASS, timeout=5)
-        s = tr.session_stats(); tor = tr.get_torrents()
-        return {"status": True, "dl": f"{round(s.download_speed/1048576,1)} MB/s", "ul": f"{round(s.upload_speed/1048576,1)} MB/s", "val1": sum(1 for x in tor if x.status not in ['stopped'] and x.error==0), "val2": sum(1 for x in tor if x.percent_done==1), "val3": len(tor), "error": sum(1 for x in tor if x.error!=0)}
-    except: return {"status": False, "msg": "连接失败"}
+    if not tr_fleet.members: return {"status": False, "msg": "未配置"}
+    return tr_fleet.poll()
 
 def get_emby_data():
+    if not EMBY_HOST: return {"status": False, "msg": "未配置"}
+    h = {"X-Emby-Token": EMBY_KEY}
+    c = EMBY_HTTP.get_json(f"{EMBY_HOST}/Items/Counts", headers=h)
+    s = EMBY_HTTP.get_json(f"{EMBY_HOST}/Sessions", headers=h)
+    return {"status": True, "title_extra": f"播放: {len([x for x in s if x.get('NowPlayingItem')])}", "val1_label": "电影", "val1": c.get('MovieCount',0), "val2_label": "剧集", "val2": c.get('SeriesCount',0), "val3_label": "单集", "val3": c.get('EpisodeCount',0), "error": 0}
+
+# 各库条目数变化很慢：按库缓存 (数量, 时间)，过期才重新请求；失败时沿用上次的值
+ABS_STATS = {}
+abs_pool = ThreadPoolExecutor(max_workers=ABS_FANOUT, thread_name_prefix="abs")
+
+def get_abs_lib_count(lib, h):
+    cached = ABS_STATS.get(lib['id'])
+    if cached and time.time() - cached[1] < ABS_STATS_TTL: return cached[0]
     try:
-        if not EMBY_HOST: return {"status": False, "msg": "未配置"}
-        h = {"X-Emby-Token": EMBY_KEY}
-        c = requests.get(f"{EMBY_HOST}/Items/Counts", headers=h, timeout=5).json()
-        s = requests.get(f"{EMBY_HOST}/Sessions", headers=h, timeout=5).json()
-        return {"status": True, "title_extra": f"播放: {len([x for x in s if x.get('NowPlayingItem')])}", "val1_label": "电影", "val1": c.get('MovieCount',0), "val2_label": "剧集", "val2": c.get('SeriesCount',0), "val3_label": "单集", "val3": c.get('EpisodeCount',0), "error": 0}
-    except: return {"status": False, "msg": "连接失败"}
+        cnt = ABS_HTTP.get_json(f"{ABS_HOST}/api/libraries/{lib['id']}/stats", headers=h).get('totalItems', 0)
+        ABS_STATS[lib['id']] = (cnt, time.time())
+        return cnt
+    except: return cached[0] if cached else 0
 
 def get_abs_data():
-    try:
-        if not ABS_HOST: return {"status": False, "msg": "未配置"}
-        h = {"Authorization": f"Bearer {ABS_KEY}"}
-        libs = requests.get(f"{ABS_HOST}/api/libraries", headers=h, timeout=5).json().get('libraries', [])
-        a = 0; p = 0
-        for lib in libs:
-            try:
-                s = requests.get(f"{ABS_HOST}/api/libraries/{lib['id']}/stats", headers=h, timeout=2).json()
-                cnt = s.get('totalItems', 0)
-                if lib.get('mediaType') == 'podcast': p += cnt
-                else: a += cnt
-            except: pass
-        act = len(requests.get(f"{ABS_HOST}/api/sessions", headers=h, timeout=3).json())
-        return {"status": True, "title_extra": f"听书: {act}", "val1_label": "有声书", "val1": a, "val2_label": "播客", "val2": p, "val3_label": "库数量", "val3": len(libs), "error": 0}
-    except: return {"status": False, "msg": "连接失败"}
+    if not ABS_HOST: return {"status": False, "msg": "未配置"}
+    h = {"Authorization": f"Bearer {ABS_KEY}"}
+    libs = ABS_HTTP.get_json(f"{ABS_HOST}/api/libraries", headers=h).get('libraries', [])
+    for lid in set(ABS_STATS) - {lib['id'] for lib in libs}: ABS_STATS.pop(lid, None)
+    counts = abs_pool.map(lambda lib: get_abs_lib_count(lib, h), libs)
+    a = 0; p = 0
+    for lib, cnt in zip(libs, counts):
+        if lib.get('mediaType') == 'podcast': p += cnt
+        else: a += cnt
+    act = len(ABS_HTTP.get_json(f"{ABS_HOST}/api/sessions", headers=h))
+    return {"status": True, "title_extra": f"听书: {act}", "val1_label": "有声书", "val1": a, "val2_label": "播客", "val2": p, "val3_label": "库数量", "val3": len(libs), "error": 0}
 
 def get_mp_subs_data():
-    d = mp_client.get("/api/v1/subscribe")
+    if not MP_HOST: return {"status": False, "msg": "未配置"}
+    d = mp_client.get("/api/v1/subscribe", max_age=MP_CACHE_TTL)
     if not d: return {"status": False, "msg": "连接断开"}
     total = 0; items = []
     if isinstance(d, dict): total = d.get('total', 0); items = d.get('data', []) or d.get('items', [])
@@ -154,47 +604,132 @@ def get_mp_subs_data():
     return {"status": True, "title_extra": "", "val1_label": "总订阅", "val1": total, "val2_label": "电影", "val2": movie, "val3_label": "剧集", "val3": tv, "error": 0}
 
 def get_mp_site_data():
-    d = mp_client.get(f"/api/v1/site?_t={int(time.time())}")
+    if not MP_HOST: return {"status": False, "msg": "未配置"}
+    d = mp_client.get("/api/v1/site", max_age=MP_CACHE_TTL)
     if not d: return {"status": False, "msg": "连接断开"}
     items = d if isinstance(d, list) else d.get('data', [])
     items = [x for x in items if isinstance(x, dict)]
     ok = sum(1 for s in items if s.get('cookie') and (s.get('is_active', True) or s.get('enable', True)))
     return {"status": True, "title_extra": "API模式", "val1_label": "配置站点", "val1": len(items), "val2_label": "Cookie在线", "val2": ok, "val3_label": "掉线/未配", "val3": len(items)-ok, "error": 0}
 
-def get_navi_stats():
-    try:
-        if not NAVI_HOST: return {"status": False, "msg": "未配置"}
+class NaviStats:
+    # 曲库统计只在扫描后才会变：以扫描状态 (是否在扫、lastScan、歌曲数、目录数、专辑/艺术家数) 为签名缓存，
+    # 签名变化且扫描结束后才在后台用 getArtists 重算专辑/艺术家数 (首次也一样，不占采集的硬超时)，
+    # 算完前先用扫描状态里的数字；采集进程里算完会通过 on_change 让 navi 采集器立即跑一轮，不用等下一轮
+    def __init__(self):
+        self.sig = None; self.totals = None; self.lock = threading.Lock(); self.recounting = False
+        self.on_change = None
+    def recount(self, sig, p):
+        try:
+            idx_res = NAVI_HTTP.get_json(f"{NAVI_HOST.rstrip('/')}/rest/getArtists", params=p)
+            indexes = idx_res.get('subsonic-response', {}).get('artists', {}).get('index', [])
+            ra = 0; ral = 0
+            for idx in indexes:
+                for art in idx.get('artist', []):
+                    ra += 1; ral += art.get('albumCount', 0)
+            with self.lock: self.totals = (ral, ra); self.sig = sig
+            if self.on_change: self.on_change()
+        except Exception as e: logger.warning(f"Navidrome 统计重算失败: {e}")
+        finally: self.recounting = False
+    def get(self):
         p = get_subsonic_auth()
-        d = requests.get(f"{NAVI_HOST.rstrip('/')}/rest/getScanStatus", params=p, timeout=5, verify=False).json()
+        d = NAVI_HTTP.get_json(f"{NAVI_HOST.rstrip('/')}/rest/getScanStatus", params=p)
         stats = d.get('subsonic-response', {}).get('scanStatus', {})
         song_count = stats.get('count', 0); album_count = stats.get('albumCount', 0); artist_count = stats.get('artistCount', 0)
-        if artist_count == 0 or album_count == 0:
+        if artist_count and album_count: return song_count, album_count, artist_count
+        sig = tuple(stats.get(k) for k in ('scanning', 'lastScan', 'count', 'folderCount', 'albumCount', 'artistCount'))
+        if sig != self.sig and not stats.get('scanning') and not self.recounting:
+            self.recounting = True
+            threading.Thread(target=self.recount, args=(sig, p), daemon=True, name="navi-recount").start()
+        if self.totals:
+            if album_count == 0: album_count = self.totals[0]
+            if artist_count == 0: artist_count = self.totals[1]
+        return song_count, album_count, artist_count
+
+navi_stats = NaviStats()
+
+def get_navi_stats():
+    if not NAVI_HOST: return {"status": False, "msg": "未配置"}
+    song_count, album_count, artist_count = navi_stats.get()
+    return {"status": True, "title_extra": "", "val1_label": "歌曲", "val1": song_count, "val2_label": "专辑", "val2": album_count, "val3_label": "艺术家", "val3": artist_count, "error": 0}
+
+class HassWatcher:
+    # 常驻一条 WebSocket，用 subscribe_entities 只订阅这几个实体 (服务端过滤，普通用户的令牌也能用)，空闲时零请求
+    # 订阅后的首条 event 就带有完整状态；老版本 HA 不支持时退回 state_changed 总线 + /api/states 批量补齐
+    def __init__(self, host, token, entities, on_change):
+        self.host = (host or "").rstrip('/'); self.token = token
+        self.entities = {e for e in entities if e and "example" not in e}
+        self.on_change = on_change
+        self.states = {}; self.connected = False
+        self.headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+    def fetch_all(self):
+        res = HASS_HTTP.get(f"{self.host}/api/states", headers=self.headers); res.raise_for_status()
+        return {x['entity_id']: x for x in res.json() if x.get('entity_id') in self.entities}
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name="hass-ws").start()
+    def run(self):
+        delay = 1
+        while True:
             try:
-                idx_res = requests.get(f"{NAVI_HOST.rstrip('/')}/rest/getArtists", params=p, timeout=5, verify=False).json()
-                indexes = idx_res.get('subsonic-response', {}).get('artists', {}).get('index', [])
-                ra = 0; ral = 0
-                for idx in indexes:
-                    for art in idx.get('artist', []):
-                        ra += 1; ral += art.get('albumCount', 0)
-                if artist_count == 0: artist_count = ra
-                if album_count == 0: album_count = ral
-            except: pass
-        return {"status": True, "title_extra": "", "val1_label": "歌曲", "val1": song_count, "val2_label": "专辑", "val2": album_count, "val3_label": "艺术家", "val3": artist_count, "error": 0}
-    except: return {"status": False, "msg": "连接失败"}
+                self.session(); delay = 1
+            except Exception as e: logger.warning(f"HA WebSocket 断开: {e}")
+            self.connected = False
+            time.sleep(delay); delay = min(delay * 2, 60)
+    def apply(self, ev):
+        # subscribe_entities 的压缩格式：a = 完整状态 {s, a}，c = 变化 {"+": {s, a}, "-": {a: [属性名]}}，r = 已移除
+        # 写时复制后整体替换，采集线程读到的总是完整的一份
+        states = dict(self.states)
+        for eid, v in ev.get('a', {}).items(): states[eid] = {"entity_id": eid, "state": v.get('s'), "attributes": v.get('a', {})}
+        for eid, d in ev.get('c', {}).items():
+            if eid not in states: continue
+            plus = d.get('+', {}); new = {**states[eid], "attributes": {**states[eid].get('attributes', {}), **plus.get('a', {})}}
+            if 's' in plus: new['state'] = plus['s']
+            for k in d.get('-', {}).get('a', []): new['attributes'].pop(k, None)
+            states[eid] = new
+        for eid in ev.get('r', []): states.pop(eid, None)
+        self.states = states
+    def session(self):
+        url = "ws" + self.host[4:] + "/api/websocket" if self.host.startswith("http") else f"ws://{self.host}/api/websocket"
+        ws = websocket.create_connection(url, timeout=HASS_HTTP.timeout)
+        try:
+            if json.loads(ws.recv()).get('type') != 'auth_required': raise RuntimeError("unexpected handshake")
+            ws.send(json.dumps({"type": "auth", "access_token": self.token}))
+            if json.loads(ws.recv()).get('type') != 'auth_ok': raise RuntimeError("auth failed")
+            ws.send(json.dumps({"id": 1, "type": "subscribe_entities", "entity_ids": sorted(self.entities)}))
+            res = json.loads(ws.recv()); sub = 1
+            if not res.get('success'):
+                logger.info(f"HA 不支持 subscribe_entities ({res.get('error')})，改为订阅 state_changed")
+                ws.send(json.dumps({"id": 2, "type": "subscribe_events", "event_type": "state_changed"}))
+                res = json.loads(ws.recv()); sub = 2
+                if not res.get('success'): raise RuntimeError(f"subscribe failed: {res.get('error')}")
+                # 先订阅再补齐，中间的变化不会丢
+                self.states = self.fetch_all(); self.connected = True; self.on_change()
+            msg_id = sub; last_msg = time.time(); ws.settimeout(30)
+            while True:
+                try: msg = json.loads(ws.recv()); last_msg = time.time()
+                except websocket.WebSocketTimeoutException:
+                    if time.time() - last_msg > 90: raise RuntimeError("ping timeout")
+                    msg_id += 1; ws.send(json.dumps({"id": msg_id, "type": "ping"})); continue
+                if msg.get('type') != 'event' or msg.get('id') != sub: continue
+                ev = msg.get('event', {})
+                if sub == 1: self.apply(ev); self.connected = True; self.on_change(); continue
+                data = ev.get('data', {})
+                if data.get('entity_id') in self.entities and data.get('new_state'):
+                    self.states = {**self.states, data['entity_id']: data['new_state']}; self.on_change()
+        finally: ws.close()
+
+hass_watcher = HassWatcher(HASS_HOST, HASS_TOKEN, [HASS_ID_TODAY_DL, HASS_ID_TODAY_UL, HASS_ID_MONTH_DL, HASS_ID_MONTH_UL], lambda: set_cache("hass", get_hass_data()))
 
 def get_hass_data():
     if not HASS_HOST or not HASS_TOKEN: return {"status": False, "msg": "未配置"}
-    headers = {"Authorization": f"Bearer {HASS_TOKEN}", "Content-Type": "application/json"}
+    states = hass_watcher.states
+    # WebSocket 不可用时退回一次批量 REST 查询；失败直接抛出，交给采集器计数、熔断并继续提供上次的数据
+    if not hass_watcher.connected: states = hass_watcher.fetch_all()
     def get_formatted_state(entity_id):
         if not entity_id or "example" in entity_id: return "N/A"
-        try:
-            url = f"{HASS_HOST.rstrip('/')}/api/states/{entity_id}"
-            res = requests.get(url, headers=headers, timeout=3)
-            if res.status_code == 200:
-                data = res.json()
-                return smart_format(data.get('state'), data.get('attributes', {}).get('unit_of_measurement'))
-        except: pass
-        return "-"
+        data = states.get(entity_id)
+        if not data: return "-"
+        return smart_format(data.get('state'), data.get('attributes', {}).get('unit_of_measurement'))
     return {
         "status": True, "title_extra": "OpenWrt",
         "val1_label": "今日下行", "val1": get_formatted_state(HASS_ID_TODAY_DL),
@@ -205,61 +740,491 @@ def get_hass_data():
     }
 
 # ================= 4. 轮询 =================
-CACHE = {}
-def loop():
-    global CACHE
+# --- 历史曲线：每个指标三档定长环形缓冲 (原始 / 分钟 / 小时)，内存恒定 ---
+class Ring:
+    def __init__(self, capacity):
+        self.cap = capacity; self.head = 0; self.size = 0
+        self.ts = array('d', bytes(8 * capacity)); self.val = array('d', bytes(8 * capacity))
+    def push(self, t, v):
+        self.ts[self.head] = t; self.val[self.head] = v
+        self.head = (self.head + 1) % self.cap; self.size = min(self.size + 1, self.cap)
+    def items(self, since=0):
+        start = (self.head - self.size) % self.cap
+        for i in range(self.size):
+            j = (start + i) % self.cap
+            if self.ts[j] >= since: yield self.ts[j], self.val[j]
+    def oldest(self): return self.ts[(self.head - self.size) % self.cap] if self.size else None
+
+class Series:
+    # (名称, 聚合步长秒, 容量)：原始最近 1200 次采样 / 分钟 24 小时 / 小时 30 天
+    RES = (("raw", 0, 1200), ("1m", 60, 1440), ("1h", 3600, 720))
+    def __init__(self):
+        self.rings = {name: Ring(cap) for name, _, cap in self.RES}
+        self.open = {name: [0.0, 0.0, 0] for name, step, _ in self.RES if step}  # 未满的桶: [起点, 累加, 个数]
+    def add(self, t, v):
+        self.rings["raw"].push(t, v)
+        for name, step, _ in self.RES[1:]:
+            o = self.open[name]; b = t - t % step
+            if o[2] and o[0] != b: self.rings[name].push(o[0], o[1] / o[2]); o[1] = 0.0; o[2] = 0
+            o[0] = b; o[1] += v; o[2] += 1
+    def query(self, span, points, now=None):
+        now = now or time.time(); since = now - span
+        raw_oldest = self.rings["raw"].oldest()
+        name = "raw" if raw_oldest is not None and raw_oldest <= since else "1m" if span <= 1440 * 60 else "1h"
+        pts = list(self.rings[name].items(since))
+        if name != "raw" and self.open[name][2]: pts.append((self.open[name][0], self.open[name][1] / self.open[name][2]))
+        if len(pts) <= points: return name, pts
+        # 降采样：按等宽时间桶求平均
+        width = span / points; buckets = {}
+        for t, v in pts:
+            b = buckets.setdefault(int((t - since) // width), [0.0, 0.0, 0]); b[0] += t; b[1] += v; b[2] += 1
+        return name, [(b[0] / b[2], b[1] / b[2]) for _, b in sorted(buckets.items())]
+
+class History:
+    # 卡片字段 -> 指标名，例如 qb.dl 取 qb 卡片的 dl_speed (字节/秒)
+    FIELDS = {"dl": "dl_speed", "ul": "ul_speed", "val1": "val1", "val2": "val2", "val3": "val3", "error": "error"}
+    def __init__(self, path):
+        self.path = path; self.series = {}; self.lock = threading.Lock(); self.changes = 0
+    def record(self, key, result, t=None):
+        if not isinstance(result, dict) or not result.get("status"): return
+        t = t or time.time()
+        with self.lock:
+            for name, field in self.FIELDS.items():
+                v = result.get(field)
+                if isinstance(v, bool) or not isinstance(v, (int, float)): continue
+                self.series.setdefault(f"{key}.{name}", Series()).add(t, float(v))
+            self.changes += 1
+    def query(self, name, span, points):
+        with self.lock:
+            s = self.series.get(name)
+            return s.query(span, points) if s else None
+    def save(self, path=None):
+        # 快照格式：gzip( 一行 JSON 索引 + 各 array 的原始字节 )；数组大半是 0，压缩级别 1 体积几乎不变、快几十倍
+        path = path or self.path
+        with self.lock:
+            meta = {}; blobs = []
+            for name, s in self.series.items():
+                meta[name] = {"open": s.open, "rings": {r: [ring.cap, ring.head, ring.size] for r, ring in s.rings.items()}}
+                for ring in s.rings.values(): blobs += [ring.ts.tobytes(), ring.val.tobytes()]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with gzip.open(tmp, 'wb', compresslevel=1) as f:
+            f.write(json.dumps(meta, separators=(',', ':')).encode('utf-8') + b"\n")
+            for b in blobs: f.write(b)
+        os.replace(tmp, path)
+    def load(self):
+        if not os.path.exists(self.path): return
+        try:
+            with gzip.open(self.path, 'rb') as f:
+                meta = json.loads(f.readline())
+                series = {}
+                for name, m in meta.items():
+                    s = Series()
+                    for r, (cap, head, size) in m["rings"].items():
+                        ts = f.read(8 * cap); val = f.read(8 * cap)
+                        ring = s.rings.get(r)
+                        if not ring or ring.cap != cap: continue  # 容量改过的档位直接丢弃
+                        ring.ts = array('d', ts); ring.val = array('d', val); ring.head = head; ring.size = size
+                    for r, o in m["open"].items():
+                        if r in s.open: s.open[r] = o
+                    series[name] = s
+            with self.lock: self.series = series
+        except Exception as e: logger.warning(f"历史快照读取失败: {e}")
+    def reload_if_changed(self):
+        # web 角色：采集进程保存了新快照才重新读取
+        try: mtime = os.stat(self.path).st_mtime_ns
+        except OSError: return
+        if mtime != getattr(self, 'loaded_mtime', None): self.load(); self.loaded_mtime = mtime
+    def autosave(self, every, path=None):
+        saved = None
+        while True:
+            time.sleep(every)
+            if self.changes == saved: continue  # 没有新采样就不重写
+            try: saved = self.changes; self.save(path)
+            except Exception as e: logger.warning(f"历史快照保存失败: {e}")
+
+# web 角色读 collector 每 HISTORY_PUBLISH 秒发布到共享目录的那份，而不是每 HISTORY_SAVE 秒才落盘一次的持久化文件
+HISTORY_SHARED = os.path.join(SHARED_DIR, "history.bin")
+HISTORY = History(HISTORY_SHARED if ROLE == "web" else HISTORY_FILE)
+
+class Snapshot:
+    # 带版本号的快照：只有内容变化才升版本，并预先序列化 + gzip，/api/data 直接返回字节
+    # publish 指定路径时 (collector 角色) 每次变化都原子写出一份，供 web worker 读取
+    def __init__(self, publish=None):
+        self.publish = publish
+        self.cond = threading.Condition()
+        self.data = {}; self.versions = {}
+        self.version = int(time.time() * 1000)  # 以毫秒时间起步，重启后版本号仍然递增
+        self._serialize()
+    def _serialize(self):
+        body = json.dumps(self.data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.packed = (body, gzip.compress(body, 6), f"v{self.version}")
+        if self.publish: self._write()
+    def _write(self):
+        # 文件格式：一行 JSON 头 (版本号、各卡片版本、正文长度) + JSON 正文 + gzip 正文
+        body, gz, _ = self.packed
+        head = json.dumps({"version": self.version, "versions": self.versions, "body_len": len(body)}, separators=(',', ':')).encode('utf-8')
+        try:
+            os.makedirs(os.path.dirname(self.publish), exist_ok=True)
+            tmp = f"{self.publish}.{os.getpid()}.tmp"
+            with open(tmp, 'wb') as f: f.write(head + b"\n" + body + gz)
+            os.replace(tmp, self.publish)
+        except OSError as e: logger.warning(f"快照发布失败: {e}")
+    def current(self): return self.packed
+    def set(self, key, value):
+        with self.cond:
+            if key in self.data and self.data[key] == value: return
+            # 写时复制后整体替换引用，读者拿到的永远是完整快照
+            data = dict(self.data); data[key] = value
+            self.version += 1; self.versions[key] = self.version
+            self.data = data; self._serialize()
+            self.cond.notify_all()
+    def changes(self, since):
+        # 返回 since 之后变化过的卡片；since 不认识(为 0 或比当前还新)时给全量
+        with self.cond:
+            if since <= 0 or since > self.version: since = 0
+            return self.version, {k: self.data[k] for k, v in self.versions.items() if v > since}
+    def wait(self, since, timeout):
+        with self.cond:
+            return self.cond.wait_for(lambda: self.version > since, timeout)
+
+class SharedSnapshot(Snapshot):
+    # web 角色：读取采集进程发布的快照文件，按 inode/mtime/大小判断是否需要重新加载
+    def __init__(self, path):
+        self.path = path; self.sig = None; self.lock = threading.Lock()
+        super().__init__()
+        self.refresh()
+    def refresh(self):
+        try: st = os.stat(self.path)
+        except OSError: return
+        sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if sig == self.sig: return
+        with self.lock:
+            if sig == self.sig: return
+            try:
+                with open(self.path, 'rb') as f: head, rest = f.read().split(b"\n", 1)
+                meta = json.loads(head); body = rest[:meta["body_len"]]
+                with self.cond:
+                    self.data = json.loads(body); self.versions = meta["versions"]; self.version = meta["version"]
+                    self.packed = (body, rest[meta["body_len"]:], f"v{self.version}")
+                self.sig = sig
+            except (OSError, ValueError, KeyError) as e: logger.warning(f"快照读取失败: {e}")
+    def current(self):
+        self.refresh(); return self.packed
+    def changes(self, since):
+        self.refresh(); return super().changes(since)
+    def wait(self, since, timeout):
+        # 跨进程没有条件变量可等，短间隔检查文件
+        end = time.time() + timeout
+        while True:
+            self.refresh()
+            if self.version > since: return True
+            if time.time() >= end: return False
+            time.sleep(0.5)
+    def set(self, key, value): raise RuntimeError("web 角色不采集数据")
+
+SNAPSHOT_FILE = os.path.join(SHARED_DIR, "snapshot.bin")
+METRICS_FILE = os.path.join(SHARED_DIR, "metrics.prom")
+STORE = SharedSnapshot(SNAPSHOT_FILE) if ROLE == "web" else Snapshot(SNAPSHOT_FILE if ROLE == "collector" else None)
+
+def set_cache(key, value): STORE.set(key, value)
+
+# 每个数据源一个独立的采集线程：各自的刷新间隔 + 硬超时，互不拖累
+# 每个数据源自带熔断器：closed -> (连续失败) -> open -> (退避到期) -> half_open 探测 -> closed / open
+# 失败期间继续提供最后一次成功的数据，并带上 stale_since (开始过期的时间戳)
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+class Collector:
+    def __init__(self, key, func, interval, deadline):
+        self.key = key; self.func = func
+        self.interval = get_env(f"INTERVAL_{key.upper()}", interval, True)
+        self.deadline = get_env(f"DEADLINE_{key.upper()}", deadline, True)
+        self.pending = None; self.timed_out = None; self.last_start = 0; self.ok = True
+        self.labels = {"source": key}
+        self.lock = threading.Lock(); self.state = "closed"
+        self.failures = 0; self.opens = 0; self.open_until = 0
+        self.last_good = None; self.stale_since = None
+    def run_once(self):
+        if self.state == "open":
+            # 熔断打开期间直接跳过，不再为已知挂掉的上游阻塞到超时
+            if time.time() < self.open_until: return self.count("short_circuit")
+            self.set_state("half_open")
+        # 上一次调用还卡在上游里就跳过，避免线程堆积
+        if self.pending and not self.pending.done():
+            METRICS.inc("ptmon_collector_skipped_total", "Runs skipped because the previous fetch was still running", self.labels); return
+        now = time.time()
+        if self.last_start: METRICS.set("ptmon_collector_period_seconds", "Actual time between the last two runs", self.labels, now - self.last_start)
+        self.last_start = now
+        fut = Future(); self.pending = fut
+        def work():
+            t0 = time.time()
+            try: res = self.func()
+            except Exception as e: res = e
+            METRICS.observe("ptmon_collector_duration_seconds", "Collector fetch latency", self.labels, time.time() - t0)
+            if isinstance(res, Exception): fut.set_exception(res)
+            else: fut.set_result(res)
+        # 超时之后上游才返回的结果依然有效，直接写回
+        fut.add_done_callback(self.finish)
+        threading.Thread(target=work, daemon=True, name=f"fetch-{self.key}").start()
+        try: fut.result(timeout=self.deadline)
+        except FuturesTimeout:
+            if not fut.done():
+                self.timed_out = fut
+                self.count("timeout", "Timeout"); self.fail("超时")
+        except Exception: pass
+    def count(self, result, err_type=None):
+        METRICS.inc("ptmon_collector_runs_total", "Collector runs by result", {**self.labels, "result": result})
+        if err_type:
+            METRICS.inc("ptmon_collector_errors_total", "Collector failures by exception type", {**self.labels, "type": err_type})
+            # 只在由好变坏时打日志，避免上游宕机时刷屏
+            if self.ok: logger.warning(f"{self.key} 采集失败: {err_type}")
+            self.ok = False
+        elif result == "success":
+            if not self.ok: logger.info(f"{self.key} 已恢复")
+            self.ok = True
+    def set_state(self, state):
+        self.state = state
+        METRICS.set("ptmon_collector_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", self.labels, BREAKER_STATES[state])
+    def fail(self, msg):
+        with self.lock:
+            now = time.time(); self.failures += 1
+            if self.stale_since is None: self.stale_since = now
+            if self.state == "half_open" or self.failures >= BREAKER_THRESHOLD:
+                self.opens += 1
+                self.open_until = now + min(max(self.interval, 5) * 2 ** (self.opens - 1), BREAKER_MAX)
+                if self.state != "open": logger.warning(f"{self.key} 熔断打开，{int(self.open_until - now)} 秒后探测")
+                self.set_state("open")
+            card = {**self.last_good, "stale_since": int(self.stale_since)} if self.last_good else {"status": False, "msg": msg}
+        self.publish(card, fresh=False)
+    def succeed(self, res):
+        with self.lock:
+            self.failures = 0; self.opens = 0; self.stale_since = None; self.last_good = res
+            if self.state != "closed": self.set_state("closed")
+        self.publish(res)
+    def finish(self, fut):
+        e = fut.exception()
+        if e is not None:
+            if fut is self.timed_out: return  # 超时那一刻已经记过失败
+            self.count("error", type(e).__name__)
+            return self.fail("连接失败")
+        res = fut.result()
+        if res.get("status"):
+            self.count("success")
+            METRICS.set("ptmon_collector_last_success_timestamp_seconds", "Unix time of the last successful fetch", self.labels, time.time())
+            METRICS.set("ptmon_collector_payload_bytes", "Serialized size of the last card payload", self.labels, len(json.dumps(res, ensure_ascii=False).encode('utf-8')))
+            self.succeed(res)
+        elif res.get("msg") == "未配置":
+            self.count("disabled"); self.publish(res)
+        elif fut is not self.timed_out:
+            self.count("error", "Unavailable"); self.fail(res.get("msg", "连接失败"))
+    def publish(self, result, fresh=True):
+        set_cache(self.key, result)
+        if fresh: HISTORY.record(self.key, result)
+    def poke(self):
+        # 数据源自己知道有新数据时 (如后台重算完成) 立即跑一轮，照常计入指标、历史、last_good 和熔断
+        threading.Thread(target=self.run_once, daemon=True, name=f"poke-{self.key}").start()
+    def loop(self):
+        while True:
+            start = time.time()
+            try: self.run_once()
+            except Exception as e: logger.warning(f"{self.key} 采集异常: {e}")
+            time.sleep(max(0.5, self.interval - (time.time() - start)))
+    def start(self):
+        threading.Thread(target=self.loop, daemon=True, name=f"collector-{self.key}").start()
+
+# key, 函数, 刷新间隔(秒), 硬超时(秒)；可用 INTERVAL_<KEY> / DEADLINE_<KEY> 覆盖
+COLLECTORS = [
+    Collector("qb", get_qb_data, 3, 10), Collector("tr", get_tr_data, 3, 10),
+    Collector("emby", get_emby_data, 15, 12), Collector("abs", get_abs_data, 30, 20),
+    Collector("mp_sub", get_mp_subs_data, 60, 20), Collector("mp_site", get_mp_site_data, 60, 20),
+    Collector("navi", get_navi_stats, 60, 15), Collector("hass", get_hass_data, 15, 10),
+]
+def update_cache_age():
+    now = time.time()
+    for c in COLLECTORS:
+        last = METRICS.get("ptmon_collector_last_success_timestamp_seconds", c.labels)
+        if last: METRICS.set("ptmon_cache_age_seconds", "Seconds since the card was last refreshed successfully", c.labels, now - last)
+
+def write_atomic(path, text):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f: f.write(text)
+    os.replace(tmp, path)
+
+def worker_metrics_file(): return os.path.join(SHARED_DIR, f"metrics-web-{os.getpid()}.json")
+
+def export_worker_metrics(every=5):
+    # web 角色：每个 worker 把自己的指标 (HTTP 延迟等) 定期写到 metrics-web-<pid>.json，/metrics 合并所有 worker
+    while True:
+        try: write_atomic(worker_metrics_file(), json.dumps(METRICS.dump()))
+        except OSError as e: logger.warning(f"指标导出失败: {e}")
+        time.sleep(every)
+
+def export_metrics(every=15):
+    # collector 角色：把采集侧指标写到共享目录，由 web worker 的 /metrics 一并输出
     while True:
         try:
-            CACHE = {
-                "qb": get_qb_data(), "tr": get_tr_data(), "emby": get_emby_data(), "abs": get_abs_data(),
-                "mp_sub": get_mp_subs_data(), "mp_site": get_mp_site_data(), "navi": get_navi_stats(), "hass": get_hass_data()
-            }
-        except: pass
-        time.sleep(15)
-threading.Thread(target=loop, daemon=True).start()
+            update_cache_age(); write_atomic(METRICS_FILE, METRICS.render())
+        except OSError as e: logger.warning(f"指标导出失败: {e}")
+        time.sleep(every)
+
+HISTORY.load()
+if ROLE in ("all", "collector"):
+    atexit.register(HISTORY.save)
+    threading.Thread(target=HISTORY.autosave, args=(HISTORY_SAVE,), daemon=True, name="history-save").start()
+    if HASS_HOST and HASS_TOKEN and hass_watcher.entities: hass_watcher.start()
+    for c in COLLECTORS: c.start()
+    navi_stats.on_change = next(c for c in COLLECTORS if c.key == "navi").poke
+if ROLE == "collector":
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    threading.Thread(target=export_metrics, daemon=True, name="metrics-export").start()
+    threading.Thread(target=HISTORY.autosave, args=(HISTORY_PUBLISH, HISTORY_SHARED), daemon=True, name="history-publish").start()
 
 # ================= 5. API =================
+# web 角色下指标导出线程按进程懒启动：gunicorn --preload 时 fork 前启动的线程不会带进 worker
+worker_export = {"pid": None}; worker_export_lock = threading.Lock()
+
+@app.before_request
+def metrics_start():
+    g.t0 = time.time()
+    if ROLE == "web" and worker_export["pid"] != os.getpid():
+        with worker_export_lock:
+            if worker_export["pid"] != os.getpid():
+                worker_export["pid"] = os.getpid(); os.makedirs(SHARED_DIR, exist_ok=True)
+                threading.Thread(target=export_worker_metrics, daemon=True, name="metrics-export").start()
+
+@app.after_request
+def metrics_end(resp):
+    # 流式响应 (代理、SSE) 在连接关闭时才计时，覆盖整个传输过程
+    t0 = g.get('t0', time.time()); rule = request.url_rule.rule if request.url_rule else "unmatched"
+    labels = {"route": rule, "method": request.method, "status": resp.status_code}
+    def observe(): METRICS.observe("ptmon_http_request_duration_seconds", "Flask request latency until the response is closed", labels, time.time() - t0)
+    # send_file 的响应直接交给服务器的 file_wrapper，不会触发 close 回调，只能在这里记
+    if resp.direct_passthrough: observe()
+    else: resp.call_on_close(observe)
+    return resp
+
+@app.route('/metrics')
+def metrics():
+    if ROLE != "web":
+        update_cache_age(); return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+    # web 角色：合并所有 worker 的指标文件 (本 worker 先写一份最新的)，再接上采集进程导出的指标
+    # 超过一小时没更新的文件属于已退出的 worker，删掉 (对应计数器会像进程重启一样归零重来)
+    merged = Metrics()
+    try: write_atomic(worker_metrics_file(), json.dumps(METRICS.dump()))
+    except OSError: pass
+    for name in os.listdir(SHARED_DIR):
+        if not (name.startswith("metrics-web-") and name.endswith(".json")): continue
+        path = os.path.join(SHARED_DIR, name)
+        try:
+            if time.time() - os.path.getmtime(path) > 3600: os.remove(path); continue
+            with open(path, encoding='utf-8') as f: merged.merge(json.load(f))
+        except (OSError, ValueError): pass
+    text = merged.render()
+    try:
+        with open(METRICS_FILE, encoding='utf-8') as f: text += f.read()
+    except OSError: pass
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/data')
-def api_data(): return jsonify(CACHE)
+def api_data():
+    body, gz, etag = STORE.current()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    elif request.accept_encodings['gzip']:  # 按 q 值判断，gzip;q=0 表示拒绝
+        resp = Response(gz, mimetype='application/json'); resp.headers['Content-Encoding'] = 'gzip'
+    else: resp = Response(body, mimetype='application/json')
+    resp.set_etag(etag); resp.headers['Cache-Control'] = 'no-cache'; resp.headers['Vary'] = 'Accept-Encoding'
+    return resp
+
+# SSE 推送：首次给全量，之后只推送变化过的卡片；断线重连时浏览器会带上 Last-Event-ID
+@app.route('/api/events')
+def api_events():
+    try: since = int(request.headers.get('Last-Event-ID') or request.args.get('v') or 0)
+    except ValueError: since = 0
+    def gen():
+        STORE.current(); v = since if since <= STORE.version else 0
+        yield "retry: 3000\n\n"
+        while True:
+            ver, cards = STORE.changes(v)
+            if cards:
+                v = ver
+                yield f"id: {v}\ndata: {json.dumps({'v': v, 'cards': cards}, ensure_ascii=False, separators=(',', ':'))}\n\n"
+            elif not STORE.wait(v, 25): yield ": ping\n\n"
+    return Response(gen(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# 历史曲线：/api/history?key=qb.dl&range=24h&points=300
+RANGE_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+@app.route('/api/history')
+def api_history():
+    key = request.args.get('key', '')
+    m = re.fullmatch(r"(\d+)([smhd])", request.args.get('range', '1h'))
+    if not m: return jsonify({"error": "Invalid range"}), 400
+    span = int(m.group(1)) * RANGE_UNITS[m.group(2)]
+    points = max(1, min(request.args.get('points', 300, type=int), 2000))
+    if ROLE == "web": HISTORY.reload_if_changed()
+    res = HISTORY.query(key, span, points)
+    if res is None: return jsonify({"error": "Unknown key", "keys": sorted(HISTORY.series)}), 404
+    return jsonify({"key": key, "range": span, "resolution": res[0], "points": [[round(t, 1), v] for t, v in res[1]]})
+
+# 透传 Range / If-Range，原样返回 206、Content-Range 等头，客户端断开时立即释放上游连接
+STREAM_PASS_HEADERS = ['Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Last-Modified']
 
 @app.route('/api/proxy/stream')
 def proxy_stream():
     if not NAVI_HOST: return "No Config", 404
     song_id = request.args.get('id')
     try:
-        p = get_subsonic_auth()
-        url = f"{NAVI_HOST.rstrip('/')}/rest/stream?id={song_id}&format=mp3&maxBitRate=320"
-        req = requests.get(url, params=p, stream=True, timeout=10, verify=False)
-        return Response(req.iter_content(chunk_size=1024*64), content_type=req.headers.get('Content-Type', 'audio/mpeg'))
+        p = get_subsonic_auth(); p.update({"id": song_id, "format": "mp3", "maxBitRate": 320})
+        h = {k: request.headers[k] for k in ('Range', 'If-Range') if k in request.headers}
+        h['Accept-Encoding'] = 'identity'  # 保证 Content-Length/Content-Range 与转发的字节一致
+        req = NAVI_HTTP.get(f"{NAVI_HOST.rstrip('/')}/rest/stream", params=p, headers=h, stream=True, timeout=(NAVI_HTTP.timeout, STREAM_TIMEOUT))
+        def gen():
+            try:
+                for chunk in req.iter_content(chunk_size=1024*64): yield chunk
+            finally: req.close()
+        resp = Response(gen(), status=req.status_code, content_type=req.headers.get('Content-Type', 'audio/mpeg'))
+        for k in STREAM_PASS_HEADERS:
+            if k in req.headers: resp.headers[k] = req.headers[k]
+        resp.call_on_close(req.close)
+        return resp
     except Exception as e: return str(e), 500
 
 @app.route('/api/proxy/cover')
 def proxy_cover():
     if not NAVI_HOST: return "No Config", 404
-    cover_id = request.args.get('id')
+    cover_id = request.args.get('id'); size = request.args.get('size', 0, type=int)
+    if not cover_id: return "", 404
+    def send(src, ctype, etag):
+        # src 为缓存文件路径；缓存目录不可用时为图片字节
+        if isinstance(src, bytes): src = io.BytesIO(src)
+        return send_file(src, mimetype=ctype, etag=etag, conditional=True, max_age=31536000)
     try:
-        p = get_subsonic_auth()
-        url = f"{NAVI_HOST.rstrip('/')}/rest/getCoverArt?id={cover_id}"
-        req = requests.get(url, params=p, stream=True, timeout=5, verify=False)
-        return Response(req.iter_content(chunk_size=1024*64), content_type=req.headers.get('Content-Type', 'image/jpeg'))
+        try: resp = send(*cover_cache.get(cover_id, size))
+        except FileNotFoundError:
+            # 命中后、发送前文件被淘汰：再取一次 (此时按未命中重新下载)
+            resp = send(*cover_cache.get(cover_id, size))
+        resp.cache_control.public = True; resp.cache_control.immutable = True
+        return resp
     except: return "", 404
 
-# [修改] 增加状态返回：是否喜欢(starred) 和 用户评分(rating)
+def song_links(song):
+    return {"src": f"/api/proxy/stream?id={song['id']}", "cover": f"/api/proxy/cover?id={song.get('coverArt','')}&size={COVER_SIZE}"}
+
+# [修改] 增加状态返回：是否喜欢(starred) 和 用户评分(rating)；next 供前端预热下一首的封面
 @app.route('/api/navi/random')
 def api_navi_random():
     if not NAVI_HOST: return jsonify({"error": "No Config"})
     try:
-        p = get_subsonic_auth(); p['size'] = 1
-        res = requests.get(f"{NAVI_HOST.rstrip('/')}/rest/getRandomSongs", params=p, timeout=5, verify=False)
-        song = res.json()['subsonic-response']['randomSongs']['song'][0]
+        song, nxt = navi_queue.pop()
         return jsonify({
             "id": song['id'], 
             "title": song['title'], 
             "artist": song.get('artist',''),
             "starred": "starred" in song, # 返回布尔值
             "rating": song.get("userRating", 0), # 返回评分(0-5)
-            "src": f"/api/proxy/stream?id={song['id']}&_t={int(time.time())}",
-            "cover": f"/api/proxy/cover?id={song.get('coverArt','')}"
+            **song_links(song),
+            "next": {"id": nxt['id'], **song_links(nxt)} if nxt else None
         })
     except Exception as e: return jsonify({"error": str(e)})
 
@@ -282,7 +1247,7 @@ def api_navi_rate():
             p['rating'] = d.get('rating', 0)
             
         if endpoint:
-            requests.get(f"{NAVI_HOST.rstrip('/')}/rest/{endpoint}", params=p, timeout=5, verify=False)
+            NAVI_HTTP.get(f"{NAVI_HOST.rstrip('/')}/rest/{endpoint}", params=p)
             return jsonify({"success": True})
         return jsonify({"error": "Invalid action"})
     except: return jsonify({"error": "Failed"})
@@ -321,8 +1286,11 @@ def index():
     <div class="row"><div class="card" id="c-navi"><div class="header"><div class="title-group"><div class="dot dot-navi"></div><span class="app-name">Navidrome</span></div><div class="info-right" id="i-navi"></div></div><div class="stats-grid" id="s-navi"></div></div><div class="card" id="c-hass"><div class="header"><div class="title-group"><div class="dot dot-hass"></div><span class="app-name">OpenWrt</span></div><div class="info-right" id="i-hass"></div></div><div class="stats-grid" id="s-hass"></div></div></div>
     <script>
     function r(d,t){if(!d||!d.status)return `<span class="offline">${d?d.msg:'loading'}</span>`;let h='';if(t=='pt'){h+=`<div class="stat-item"><span class="label">运行</span><span class="value">${d.val1}</span></div><div class="stat-item"><span class="label">完成</span><span class="value">${d.val2}</span></div><div class="stat-item"><span class="label">错误</span><span class="value" style="color:${d.error>0?'#f00':'#fff'}">${d.error}</span></div><div class="stat-item"><span class="label">总计</span><span class="value">${d.val3}</span></div>`;}else if(d.val4_label){h+=`<div class="stat-item"><span class="label">${d.val1_label}</span><span class="value">${d.val1}</span></div><div class="stat-item"><span class="label">${d.val2_label}</span><span class="value">${d.val2}</span></div><div class="stat-item"><span class="label">${d.val3_label}</span><span class="value">${d.val3}</span></div><div class="stat-item"><span class="label">${d.val4_label}</span><span class="value">${d.val4}</span></div>`;}else{h+=`<div class="stat-item"><span class="label">${d.val1_label}</span><span class="value">${d.val1}</span></div><div class="stat-item"><span class="label">${d.val2_label}</span><span class="value">${d.val2}</span></div><div class="stat-item"><span class="label">${d.val3_label}</span><span class="value">${d.val3}</span></div><div class="stat-item"><span class="label">状态</span><span class="value" style="color:#52B54B">OK</span></div>`;}return h;}
-    function u(){fetch('/api/data').then(r=>r.json()).then(d=>{['qb','tr','emby','abs','mp_sub','mp_site','navi','hass'].forEach(k=>{let el=document.getElementById('s-'+k);if(el)el.innerHTML=r(d[k],(k=='qb'||k=='tr')?'pt':'media');let ei=document.getElementById('i-'+k);if(ei&&d[k]&&d[k].status){if(k=='qb'||k=='tr')ei.innerText=`⬇${d[k].dl.replace(' MB/s','M')} ⬆${d[k].ul.replace(' MB/s','M')}`;else ei.innerText=d[k].title_extra||'';}});});}
-    u();setInterval(u,5000);
+    const K=['qb','tr','emby','abs','mp_sub','mp_site','navi','hass'];let H={};
+    function show(k,v){let el=document.getElementById('s-'+k);let h=r(v,(k=='qb'||k=='tr')?'pt':'media');if(el&&H[k]!==h){H[k]=h;el.innerHTML=h;}let ei=document.getElementById('i-'+k);if(ei&&v&&v.status){if(k=='qb'||k=='tr')ei.innerText=`⬇${v.dl.replace(' MB/s','M')} ⬆${v.ul.replace(' MB/s','M')}`+(v.instances&&v.instances.length>1?` ${v.online}/${v.instances.length}`:'');else ei.innerText=v.title_extra||'';if(v.stale_since)ei.innerText='⚠'+new Date(v.stale_since*1000).toLocaleTimeString().slice(0,5)+' '+ei.innerText;ei.style.color=v.stale_since?'#f0ad4e':'';}}
+    function u(){fetch('/api/data').then(r=>r.json()).then(d=>K.forEach(k=>show(k,d[k])));}
+    K.forEach(k=>show(k,undefined));
+    if(window.EventSource){const es=new EventSource('/api/events');es.onmessage=e=>{const m=JSON.parse(e.data);Object.keys(m.cards).forEach(k=>show(k,m.cards[k]));};}else{u();setInterval(u,5000);}
     </script></body></html>"""
 
 @app.route('/player')
@@ -385,6 +1353,8 @@ def player():
             updateUI();
             
             audio.src=d.src;
+            // 预热下一首的封面；音频不预热，/rest/stream 一请求就会在上游开一路完整转码
+            if(d.next){new Image().src=d.next.cover;}
             var p=audio.play();
             if(p!==undefined){p.then(_=>{updatePlayBtn(true);document.getElementById('autoplay-overlay').style.display='none';}).catch(e=>{updatePlayBtn(false);document.getElementById('autoplay-overlay').style.display='flex';});}
         });
@@ -445,4 +1415,7 @@ def player():
     </script></body></html>"""
 
 if __name__ == '__main__':
+    if ROLE == "collector":
+        logger.info(f"collector 模式：快照发布到 {SNAPSHOT_FILE}")
+        while True: time.sleep(3600)
     app.run(host='0.0.0.0', port=8501)
\ No newline at end of file
@@ -0,0 +1,351 @@
+# pt-monitor 基准测试：在本地启动各上游的替身服务，测量采集耗时 / CPU / 内存、/api/data 吞吐和代理流速
+#
+#   python bench.py --torrents 10000 --abs-libs 50 --mp-sites 100 --latency 0.02 --fail-rate 0.05
+#
+# 替身服务跑在独立子进程里，采集侧的 CPU / 内存数字不会混进服务端的开销。
+import argparse
+import base64
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SERVICES = ["qb", "tr", "emby", "abs", "mp", "navi", "hass"]
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+# ================= 1. 假数据 =================
+def make_data(cfg):
+    rnd = random.Random(cfg["seed"])
+    qb_states = ['downloading', 'uploading', 'stalledUP', 'pausedUP', 'pausedDL', 'error', 'missingFiles', 'queuedDL']
+    qb = {}
+    for i in range(cfg["torrents"]):
+        qb[f"{i:040x}"] = {"name": f"torrent-{i}", "state": rnd.choice(qb_states), "progress": 1 if rnd.random() < 0.7 else round(rnd.random(), 3),
+                           "tracker": f"https://tracker{i % 12}.example.org/announce", "size": rnd.randint(1 << 20, 1 << 36),
+                           "dlspeed": 0, "upspeed": rnd.randint(0, 1 << 20), "ratio": round(rnd.random() * 5, 3), "save_path": "/downloads/", "category": "pt"}
+    tr = [{"id": i + 1, "hashString": f"{i:040x}", "name": f"torrent-{i}", "status": rnd.choice([0, 4, 6, 6, 6]), "error": 1 if rnd.random() < 0.02 else 0,
+           "percentDone": 1 if rnd.random() < 0.7 else round(rnd.random(), 3), "trackers": [{"announce": f"https://tracker{i % 12}.example.org/announce", "id": 0, "tier": 0}],
+           "totalSize": rnd.randint(1 << 20, 1 << 36), "rateUpload": 0, "rateDownload": 0, "uploadRatio": round(rnd.random() * 5, 3)} for i in range(cfg["torrents"])]
+    abs_libs = [{"id": f"lib{i}", "name": f"Library {i}", "mediaType": "podcast" if i % 4 == 0 else "book"} for i in range(cfg["abs_libs"])]
+    artists = [{"id": f"ar{i}", "name": f"Artist {i}", "albumCount": rnd.randint(1, 12)} for i in range(cfg["navi_artists"])]
+    return {"qb": qb, "tr": tr, "abs_libs": abs_libs, "artists": artists, "rnd": rnd,
+            "mp_sites": [{"id": i, "name": f"site{i}", "cookie": "c=1" if rnd.random() < 0.9 else "", "is_active": True} for i in range(cfg["mp_sites"])],
+            "mp_subs": [{"id": i, "type": rnd.choice(["电影", "电视剧"]), "name": f"sub{i}"} for i in range(cfg["mp_subs"])],
+            "songs": [{"id": f"so{i}", "title": f"Song {i}", "artist": f"Artist {i % 500}", "coverArt": f"al-{i % 300}"} for i in range(2000)],
+            "stream": os.urandom(1 << 16) * max(1, int(cfg["stream_mb"] * 16)), "cover": os.urandom(40 * 1024)}
+
+# ================= 2. 替身服务 =================
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"; disable_nagle_algorithm = True
+    service = None; cfg = None; data = None; lock = threading.Lock(); rid = 0
+
+    def log_message(self, *a): pass
+
+    def reply(self, body, status=200, ctype="application/json", headers=None):
+        if not isinstance(body, (bytes, bytearray)): body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", ctype); self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers(); self.wfile.write(body)
+
+    def handle_any(self, method):
+        if self.cfg["latency"]: time.sleep(self.cfg["latency"])
+        u = urlparse(self.path); q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        n = int(self.headers.get("Content-Length") or 0); raw = self.rfile.read(n) if n else b""
+        if "form-urlencoded" in self.headers.get("Content-Type", ""): q.update({k: v[0] for k, v in parse_qs(raw.decode()).items()})
+        if self.data["rnd"].random() < self.cfg["fail_rate"]: return self.reply({"error": "injected"}, 500)
+        getattr(self, f"route_{self.service}")(method, u.path, q, raw)
+
+    def do_GET(self):
+        if self.headers.get("Upgrade", "").lower() == "websocket": return self.websocket()
+        self.handle_any("GET")
+    def do_POST(self): self.handle_any("POST")
+
+    # --- qBittorrent ---
+    def route_qb(self, method, path, q, raw):
+        if path == "/api/v2/auth/login": return self.reply(b"Ok.", ctype="text/plain", headers={"Set-Cookie": "SID=bench; path=/"})
+        if path == "/api/v2/app/version": return self.reply(b"v4.6.4", ctype="text/plain")
+        if path == "/api/v2/app/webapiVersion": return self.reply(b"2.9.3", ctype="text/plain")
+        if path == "/api/v2/sync/maindata":
+            tor = self.data["qb"]; rnd = self.data["rnd"]
+            state = {"dl_info_speed": rnd.randint(0, 50 << 20), "up_info_speed": rnd.randint(0, 50 << 20)}
+            with self.lock:
+                Handler.rid += 1
+                if int(q.get("rid", 0)) == 0: return self.reply({"rid": Handler.rid, "full_update": True, "torrents": tor, "server_state": state})
+                changed = {}
+                for h in rnd.sample(list(tor), min(len(tor), max(1, int(len(tor) * self.cfg["churn"])))):
+                    tor[h]["state"] = rnd.choice(['downloading', 'uploading', 'stalledUP']); changed[h] = {"state": tor[h]["state"]}
+                return self.reply({"rid": Handler.rid, "torrents": changed, "server_state": state})
+        if path == "/api/v2/transfer/info": return self.reply({"dl_info_speed": 0, "up_info_speed": 0})
+        if path == "/api/v2/torrents/info": return self.reply([{"hash": h, **t} for h, t in self.data["qb"].items()])
+        self.reply({}, 404)
+
+    # --- Transmission ---
+    def route_tr(self, method, path, q, raw):
+        if self.headers.get("X-Transmission-Session-Id") != "bench":
+            return self.reply(b"", 409, headers={"X-Transmission-Session-Id": "bench"})
+        req = json.loads(raw or b"{}"); m = req.get("method"); args = req.get("arguments", {}); tag = req.get("tag")
+        rnd = self.data["rnd"]
+        if m == "session-get":
+            res = {"rpc-version": 17, "rpc-version-minimum": 14, "rpc-version-semver": "5.3.0", "version": "4.0.5 (bench)", "download-dir": "/downloads"}
+        elif m == "session-stats":
+            cur = {"uploadedBytes": 0, "downloadedBytes": 0, "filesAdded": 0, "sessionCount": 1, "secondsActive": 1}
+            res = {"downloadSpeed": rnd.randint(0, 50 << 20), "uploadSpeed": rnd.randint(0, 50 << 20), "activeTorrentCount": 0, "pausedTorrentCount": 0,
+                   "torrentCount": len(self.data["tr"]), "cumulative-stats": cur, "current-stats": cur}
+        elif m == "torrent-get":
+            fields = args.get("fields") or (list(self.data["tr"][0]) if self.data["tr"] else [])
+            tor = self.data["tr"]; res = {}
+            if args.get("ids") == "recently-active":
+                tor = rnd.sample(tor, min(len(tor), max(1, int(len(tor) * self.cfg["churn"])))); res["removed"] = []
+            res["torrents"] = [{k: t[k] for k in fields if k in t} for t in tor]
+        else: res = {}
+        self.reply({"result": "success", "arguments": res, "tag": tag})
+
+    # --- Emby ---
+    def route_emby(self, method, path, q, raw):
+        if path == "/Items/Counts": return self.reply({"MovieCount": 1200, "SeriesCount": 300, "EpisodeCount": 15000})
+        if path == "/Sessions": return self.reply([{"Id": i, "NowPlayingItem": {"Name": "x"} if i % 2 else None} for i in range(6)])
+        self.reply({}, 404)
+
+    # --- Audiobookshelf ---
+    def route_abs(self, method, path, q, raw):
+        if path == "/api/libraries": return self.reply({"libraries": self.data["abs_libs"]})
+        if path.startswith("/api/libraries/") and path.endswith("/stats"): return self.reply({"totalItems": 250, "totalAuthors": 40})
+        if path == "/api/sessions": return self.reply([{"id": "s1"}])
+        self.reply({}, 404)
+
+    # --- MoviePilot ---
+    def route_mp(self, method, path, q, raw):
+        if path == "/api/v1/login/access-token": return self.reply({"access_token": "bench", "token_type": "bearer"})
+        if path == "/api/v1/subscribe": return self.reply(self.data["mp_subs"])
+        if path == "/api/v1/site": return self.reply(self.data["mp_sites"])
+        self.reply({}, 404)
+
+    # --- Navidrome ---
+    def route_navi(self, method, path, q, raw):
+        def sub(body): return self.reply({"subsonic-response": {"status": "ok", "version": "1.16.1", **body}})
+        if path == "/rest/getScanStatus":
+            # artistCount 为 0 时 NaviStats 会在后台线程用 getArtists 全量重算；卡片本身只计 getScanStatus，重算单独测 (见 main 的 recount 行)
+            return sub({"scanStatus": {"scanning": False, "count": 80000, "folderCount": 5000, "lastScan": "2026-01-01T00:00:00Z", "albumCount": 0, "artistCount": 0}})
+        if path == "/rest/getArtists":
+            arts = self.data["artists"]
+            return sub({"artists": {"index": [{"name": str(i), "artist": arts[i::26]} for i in range(26)]}})
+        if path == "/rest/getRandomSongs":
+            return sub({"randomSongs": {"song": self.data["rnd"].sample(self.data["songs"], int(q.get("size", 10)))}})
+        if path == "/rest/getCoverArt": return self.reply(self.data["cover"], ctype="image/jpeg")
+        if path == "/rest/stream":
+            body = self.data["stream"]; rng = self.headers.get("Range")
+            if rng and rng.startswith("bytes="):
+                a, _, b = rng[6:].partition("-"); a = int(a or 0); b = min(int(b) if b else len(body) - 1, len(body) - 1)
+                return self.reply(body[a:b + 1], 206, "audio/mpeg", {"Accept-Ranges": "bytes", "Content-Range": f"bytes {a}-{b}/{len(body)}"})
+            return self.reply(body, 200, "audio/mpeg", {"Accept-Ranges": "bytes"})
+        if path in ("/rest/star", "/rest/unstar", "/rest/setRating"): return sub({})
+        self.reply({}, 404)
+
+    # --- Home Assistant：REST 批量 /api/states + WebSocket (auth -> subscribe_trigger -> 定时推送 event) ---
+    def route_hass(self, method, path, q, raw):
+        if path == "/api/states":
+            return self.reply([{"entity_id": f"sensor.bench_{i}", "state": str(self.data["rnd"].randint(1, 1 << 34)), "attributes": {"unit_of_measurement": "B"}} for i in range(4)]
+                              + [{"entity_id": f"sensor.other_{i}", "state": "on", "attributes": {}} for i in range(self.cfg["hass_entities"])])
+        self.reply({}, 404)
+
+    # 最小 WebSocket：握手 + 文本帧编解码，只覆盖 app 用到的消息
+    def ws_send(self, obj):
+        data = json.dumps(obj).encode("utf-8"); n = len(data)
+        head = bytes([0x81, n]) if n < 126 else struct.pack("!BBH", 0x81, 126, n) if n < 65536 else struct.pack("!BBQ", 0x81, 127, n)
+        self.wfile.write(head + data); self.wfile.flush()
+
+    def ws_recv(self):
+        b1, b2 = self.rfile.read(2); n = b2 & 0x7F
+        if n == 126: n = struct.unpack("!H", self.rfile.read(2))[0]
+        elif n == 127: n = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if b2 & 0x80 else bytes(4)
+        data = bytes(x ^ mask[i % 4] for i, x in enumerate(self.rfile.read(n)))
+        if b1 & 0x0F == 0x8: raise ConnectionError("closed")
+        return json.loads(data) if b1 & 0x0F == 0x1 else {}
+
+    def websocket(self):
+        if self.service != "hass" or urlparse(self.path).path != "/api/websocket": return self.reply({}, 404)
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + WS_GUID).encode()).digest()).decode()
+        self.send_response(101); self.send_header("Upgrade", "websocket"); self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept); self.end_headers(); self.wfile.flush()
+        self.close_connection = True; wlock = threading.Lock(); closed = threading.Event(); rnd = self.data["rnd"]
+        try:
+            self.ws_send({"type": "auth_required", "ha_version": "bench"})
+            if self.ws_recv().get("type") != "auth": return self.ws_send({"type": "auth_invalid"})
+            self.ws_send({"type": "auth_ok", "ha_version": "bench"})
+            # subscribe_entities (--hass-legacy 时按老版本 HA 拒绝)；subscribe_events 推送全屋 state_changed，由 app 自己过滤
+            while True:
+                sub = self.ws_recv()
+                if sub.get("type") == "subscribe_entities" and sub.get("entity_ids") and not self.cfg["hass_legacy"]:
+                    ents = sub["entity_ids"]; break
+                if sub.get("type") == "subscribe_events" and sub.get("event_type") == "state_changed":
+                    ents = [f"sensor.bench_{i}" for i in range(4)] + [f"sensor.other_{i}" for i in range(self.cfg["hass_entities"])]; break
+                self.ws_send({"id": sub.get("id"), "type": "result", "success": False, "error": {"code": "unknown_command"}})
+            self.ws_send({"id": sub["id"], "type": "result", "success": True, "result": None})
+            def state(): return str(rnd.randint(1, 1 << 34))
+            if sub["type"] == "subscribe_entities":
+                self.ws_send({"id": sub["id"], "type": "event", "event": {"a": {e: {"s": state(), "a": {"unit_of_measurement": "B"}, "c": "x", "lc": time.time()} for e in ents}}})
+            def reader():
+                try:
+                    while True:
+                        m = self.ws_recv()
+                        if m.get("type") == "ping":
+                            with wlock: self.ws_send({"id": m["id"], "type": "pong"})
+                except (OSError, ValueError): pass
+                closed.set()
+            threading.Thread(target=reader, daemon=True).start()
+            while not closed.wait(self.cfg["hass_push"]):
+                e = rnd.choice(ents[:4] if rnd.random() < 0.5 else ents); s = state()  # 一半推送落在监控的实体上
+                if sub["type"] == "subscribe_entities": ev = {"c": {e: {"+": {"s": s, "c": "x", "lc": time.time()}}}}
+                else: ev = {"event_type": "state_changed", "data": {"entity_id": e, "old_state": None, "new_state": {"entity_id": e, "state": s, "attributes": {"unit_of_measurement": "B"}}}}
+                with wlock: self.ws_send({"id": sub["id"], "type": "event", "event": ev})
+        except (OSError, ValueError): pass
+
+def serve(cfg, ports, ready):
+    data = make_data(cfg); servers = []
+    for name in SERVICES:
+        h = type(f"{name}Handler", (Handler,), {"service": name, "cfg": cfg, "data": data})
+        srv = ThreadingHTTPServer(("127.0.0.1", 0), h); srv.daemon_threads = True
+        ports[name] = srv.server_address[1]; servers.append(srv)
+        threading.Thread(target=srv.serve_forever, daemon=True).start()
+    ready.set()
+    while True: time.sleep(3600)
+
+# ================= 3. 测量 =================
+def measure(func, rounds):
+    walls = []; cpus = []; peaks = []; fails = 0
+    for _ in range(rounds):
+        tracemalloc.start(); w0 = time.perf_counter(); c0 = time.process_time()
+        try:
+            res = func()
+            if not (isinstance(res, dict) and res.get("status")): fails += 1
+        except Exception: fails += 1
+        walls.append(time.perf_counter() - w0); cpus.append(time.process_time() - c0)
+        peaks.append(tracemalloc.get_traced_memory()[1]); tracemalloc.stop()
+    return {"wall_ms_p50": statistics.median(walls) * 1000, "wall_ms_max": max(walls) * 1000, "cpu_ms_p50": statistics.median(cpus) * 1000,
+            "peak_kb": max(peaks) / 1024, "failures": fails}
+
+def safe_run(c):
+    try: return c.func()
+    except Exception as e: return {"status": False, "msg": type(e).__name__}
+
+def throughput(client, path, seconds, threads, headers=None):
+    stop = time.time() + seconds; counts = []
+    def worker():
+        n = 0
+        while time.time() < stop:
+            client.get(path, headers=headers or {}).close(); n += 1
+        counts.append(n)
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    return sum(counts) / seconds
+
+def main():
+    ap = argparse.ArgumentParser(description="pt-monitor benchmark with local fake upstreams")
+    ap.add_argument("--torrents", type=int, default=10000)
+    ap.add_argument("--abs-libs", type=int, default=50)
+    ap.add_argument("--mp-sites", type=int, default=100)
+    ap.add_argument("--mp-subs", type=int, default=200)
+    ap.add_argument("--navi-artists", type=int, default=5000)
+    ap.add_argument("--hass-entities", type=int, default=500, help="与监控无关的 HA 实体数，放大 /api/states 的体积")
+    ap.add_argument("--hass-push", type=float, default=0.1, help="HA WebSocket 替身推送状态变化的间隔(秒)")
+    ap.add_argument("--hass-legacy", action="store_true", help="HA 替身不支持 subscribe_entities，测 state_changed 退路")
+    ap.add_argument("--instances", type=int, default=1, help="qB / TR 各配置多少个实例 (都指向同一个替身服务)")
+    ap.add_argument("--churn", type=float, default=0.01, help="每次增量里变化的种子比例")
+    ap.add_argument("--latency", type=float, default=0.0, help="每个上游请求注入的延迟(秒)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="上游随机返回 500 的比例")
+    ap.add_argument("--stream-mb", type=float, default=8)
+    ap.add_argument("--rounds", type=int, default=5)
+    ap.add_argument("--seconds", type=float, default=3, help="吞吐测试时长")
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="结果另存为 JSON 文件")
+    a = ap.parse_args()
+    cfg = {"instances": a.instances, "torrents": a.torrents, "abs_libs": a.abs_libs, "mp_sites": a.mp_sites, "mp_subs": a.mp_subs, "navi_artists": a.navi_artists,
+           "hass_entities": a.hass_entities, "hass_push": a.hass_push, "hass_legacy": a.hass_legacy, "churn": a.churn, "latency": a.latency, "fail_rate": a.fail_rate, "stream_mb": a.stream_mb, "seed": a.seed}
+
+    mgr = multiprocessing.Manager(); ports = mgr.dict(); ready = mgr.Event()
+    proc = multiprocessing.Process(target=serve, args=(cfg, ports, ready), daemon=True); proc.start()
+    ready.wait(60)
+
+    # app 在 import 时读取配置：先把环境变量指向替身服务；web 角色不启动后台采集，避免干扰测量
+    tmp = tempfile.mkdtemp(prefix="ptmon-bench-"); base = lambda k: f"http://127.0.0.1:{ports[k]}"
+    os.environ.update({
+        "ROLE": "web", "SHARED_DIR": os.path.join(tmp, "shared"), "HISTORY_FILE": os.path.join(tmp, "history.bin"), "COVER_CACHE_DIR": os.path.join(tmp, "covers"),
+        "QB_HOST": "127.0.0.1", "QB_PORT": str(ports["qb"]), "QB_USER": "admin", "QB_PASS": "bench",
+        "TR_HOST": "127.0.0.1", "TR_PORT": str(ports["tr"]), "TR_USER": "admin", "TR_PASS": "bench",
+        "EMBY_HOST": base("emby"), "EMBY_KEY": "bench", "ABS_HOST": base("abs"), "ABS_KEY": "bench",
+        "MP_HOST": base("mp"), "MP_USER": "admin", "MP_PASS": "bench", "NAVI_HOST": base("navi"), "NAVI_USER": "admin", "NAVI_PASS": "bench",
+        "HASS_HOST": base("hass"), "HASS_TOKEN": "bench", "HASS_ID_TODAY_DL": "sensor.bench_0", "HASS_ID_TODAY_UL": "sensor.bench_1",
+        "HASS_ID_MONTH_DL": "sensor.bench_2", "HASS_ID_MONTH_UL": "sensor.bench_3",
+    })
+    for i in range(1, a.instances):
+        os.environ.update({f"QB_HOST_{i}": "127.0.0.1", f"QB_PORT_{i}": str(ports["qb"]), f"QB_USER_{i}": "admin", f"QB_PASS_{i}": "bench",
+                           f"TR_HOST_{i}": "127.0.0.1", f"TR_PORT_{i}": str(ports["tr"]), f"TR_USER_{i}": "admin", f"TR_PASS_{i}": "bench"})
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    results = {"config": cfg, "collectors": {}}
+    print(f"{'collector':<10}{'p50 ms':>10}{'max ms':>10}{'cpu ms':>10}{'peak KB':>10}{'fail':>6}")
+    for c in app.COLLECTORS:
+        r = measure(c.func, a.rounds); results["collectors"][c.key] = r
+        print(f"{c.key:<10}{r['wall_ms_p50']:>10.1f}{r['wall_ms_max']:>10.1f}{r['cpu_ms_p50']:>10.1f}{r['peak_kb']:>10.0f}{r['failures']:>6}")
+    # Navidrome 的 getArtists 重算平时在后台线程，这里同步调用单独计时
+    def recount():
+        app.navi_stats.totals = None; app.navi_stats.recount(("bench",), app.get_subsonic_auth())
+        return {"status": app.navi_stats.totals is not None}
+    while app.navi_stats.recounting: time.sleep(0.05)  # 等上面 navi 行触发的后台重算结束，免得叠在一起
+    r = measure(recount, a.rounds); results["collectors"]["navi_recount"] = r
+    print(f"{'recount':<10}{r['wall_ms_p50']:>10.1f}{r['wall_ms_max']:>10.1f}{r['cpu_ms_p50']:>10.1f}{r['peak_kb']:>10.0f}{r['failures']:>6}")
+
+    # HA WebSocket：连上替身并完成 auth / 订阅 / 首次补齐的耗时，以及之后收到的推送数
+    calls = []; first = threading.Event()
+    hw = app.HassWatcher(base("hass"), "bench", [f"sensor.bench_{i}" for i in range(4)], lambda: (calls.append(time.perf_counter()), first.set()))
+    w0 = time.perf_counter(); hw.start(); first.wait(10)
+    time.sleep(a.seconds); pushes = max(0, len(calls) - 1)
+    results["hass_ws"] = {"connect_ms": (calls[0] - w0) * 1000 if calls else None, "pushes": pushes, "connected": hw.connected, "entities": len(hw.states)}
+    print(f"hass websocket: " + (f"subscribed in {(calls[0] - w0) * 1000:.1f} ms, {len(hw.states)} entities, {pushes} pushes in {a.seconds:g}s" if calls else "not connected"))
+
+    # 一轮完整采集：所有数据源并发各跑一次，相当于调度器下最慢的那张卡片
+    with ThreadPoolExecutor(max_workers=len(app.COLLECTORS)) as pool:
+        w0 = time.perf_counter(); outs = list(pool.map(safe_run, app.COLLECTORS)); cycle = time.perf_counter() - w0
+    results["poll_cycle_ms"] = cycle * 1000
+    print(f"\npoll cycle (concurrent): {cycle * 1000:.1f} ms")
+
+    # 把这一轮结果发布成共享快照，web 角色的 /api/data 直接读取
+    writer = app.Snapshot(app.SNAPSHOT_FILE)
+    for c, res in zip(app.COLLECTORS, outs): writer.set(c.key, res)
+    client = app.app.test_client()
+    etag = client.get("/api/data").headers.get("ETag")
+    results["api_data_rps"] = throughput(client, "/api/data", a.seconds, a.threads, {"Accept-Encoding": "gzip"})
+    results["api_data_304_rps"] = throughput(client, "/api/data", a.seconds, a.threads, {"If-None-Match": etag})
+    print(f"/api/data: {results['api_data_rps']:.0f} req/s (gzip), {results['api_data_304_rps']:.0f} req/s (304)")
+
+    # 代理流速：整首 + 一次 Range 请求
+    w0 = time.perf_counter(); resp = client.get("/api/proxy/stream?id=so1"); size = len(resp.data); dt = time.perf_counter() - w0
+    part = client.get("/api/proxy/stream?id=so1", headers={"Range": "bytes=1024-2047"})
+    results["stream_mb_s"] = size / 1048576 / dt; results["stream_range_status"] = part.status_code
+    print(f"/api/proxy/stream: {results['stream_mb_s']:.1f} MB/s over {size / 1048576:.1f} MB, Range -> {part.status_code}")
+    w0 = time.perf_counter(); n = 0
+    for i in range(50): n += len(client.get(f"/api/proxy/cover?id=al-{i % 10}&size=300").data)
+    results["cover_ms_avg"] = (time.perf_counter() - w0) / 50 * 1000
+    print(f"/api/proxy/cover: {results['cover_ms_avg']:.2f} ms avg (10 covers x 5)")
+
+    if a.json:
+        with open(a.json, "w", encoding="utf-8") as f: json.dump(results, f, indent=2, ensure_ascii=False)
+    proc.terminate()
+
+if __name__ == "__main__":
+    main()